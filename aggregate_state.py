@@ -0,0 +1,159 @@
+"""Running aggregates of the special parameter groups"""
+# %%
+import os
+import numpy as np
+import pandas as pd
+from schema import Schema
+
+
+# %%
+class AggregateState:
+    """
+    Latest value of every special parameter (member) and running MIN, MAX,
+    SUM, COUNT and latest INPUTDATE of every group, kept in a pickle
+    (AGGREGATE_STATE_PATH). An incremental run updates the groups of its new
+    values directly, only groups where a member got a new value are computed
+    again, from the stored members. Groups not in the state yet are extracted
+    from XFP in full once.
+    """
+    __PATH = os.environ.get('AGGREGATE_STATE_PATH', 'aggregate_state.pkl')
+    # latest input of a member wins, as in main.merge
+    MEMBER_KEY = ["MANCODE", "EMI_MASTER", "PARENTEMI", "SUBEMI",
+                  "BATCHID", "PARAMETERCODE", "description"]
+    GROUP_KEY = ["MANCODE", "family", "area", "description",
+                 "agg_function", "dataformat", "groupid"]
+    RANGE_COLUMNS = ["value_min", "value_max", "tolerance_min", "tolerance_max"]
+    __MEMBER_COLUMNS = list(dict.fromkeys(MEMBER_KEY + GROUP_KEY + [
+        "INPUTINDEX", "INPUTDATE", "VALUE"] + RANGE_COLUMNS))
+    __GROUP_COLUMNS = GROUP_KEY + ["MIN", "MAX", "SUM", "COUNT", "INPUTDATE"] + RANGE_COLUMNS
+
+    @classmethod
+    def load(cls):
+        """Stored members and groups, (None, None) when there is no state"""
+        if not os.path.exists(cls.__PATH):
+            return None, None
+        state = pd.read_pickle(cls.__PATH)
+        return state["members"], state["groups"]
+
+    @classmethod
+    def save(cls, members, groups):
+        """Keep the state, call once the run is written"""
+        pd.to_pickle({"members": Schema.plain(members), "groups": Schema.plain(groups)},
+                     cls.__PATH + ".tmp")
+        os.replace(cls.__PATH + ".tmp", cls.__PATH)
+
+    @staticmethod
+    def known(members, mancodes):
+        """(MANCODE, groupid) pairs of the given orders that are in the state"""
+        if members is None or members.empty:
+            return set()
+        members = members.loc[members["MANCODE"].isin(list(mancodes))]
+        return set(zip(members["MANCODE"], members["groupid"]))
+
+    @classmethod
+    def update(cls, dataframe, members=None, groups=None):
+        """
+        Add the latest member values of dataframe to the state.
+        Returns the aggregates of the touched groups and the new members and groups.
+        """
+        incoming = Schema.plain(dataframe).loc[:, cls.__MEMBER_COLUMNS]
+        incoming["VALUE"] = pd.to_numeric(incoming["VALUE"], errors='coerce')
+        incoming = cls.__latest(incoming)
+        if members is None or groups is None:
+            members = incoming
+            groups = cls.aggregate(members)
+            return cls.output(groups), members, groups
+
+        # older inputs than the stored ones are left out
+        stored = members.set_index(cls.MEMBER_KEY)
+        incoming = incoming.set_index(cls.MEMBER_KEY)
+        previous = stored.reindex(incoming.index)
+        newer = previous["INPUTINDEX"].isna() | \
+            (incoming["INPUTINDEX"] >= previous["INPUTINDEX"])
+        incoming, previous = incoming.loc[newer], previous.loc[newer]
+        replaced = previous["INPUTINDEX"].notna()
+        members = pd.concat([stored.loc[~stored.index.isin(incoming.index)], incoming],
+                            sort=False).reset_index()
+        incoming = incoming.reset_index()
+
+        groups = groups.set_index(cls.GROUP_KEY)
+        touched = cls.__groups(incoming)
+        # a member with a new value may have been the min or max, recount those groups
+        recount = cls.__groups(incoming.loc[replaced.values]).union(
+            touched.difference(groups.index))
+        running = touched.difference(recount)
+
+        df_new = cls.aggregate(incoming.loc[cls.__keys(incoming).isin(running)]) \
+            .set_index(cls.GROUP_KEY)
+        df_old = groups.loc[df_new.index]
+        df_new["MIN"] = np.fmin(df_old["MIN"], df_new["MIN"])
+        df_new["MAX"] = np.fmax(df_old["MAX"], df_new["MAX"])
+        df_new["SUM"] = df_old["SUM"] + df_new["SUM"]
+        df_new["COUNT"] = df_old["COUNT"] + df_new["COUNT"]
+        df_new["INPUTDATE"] = np.maximum(df_old["INPUTDATE"], df_new["INPUTDATE"])
+        for column in cls.RANGE_COLUMNS:
+            old, new = df_old[column], df_new[column]
+            df_new[column] = old.where(new.isna() | (old.notna() & (old >= new)), new)
+
+        df_recount = cls.aggregate(members.loc[cls.__keys(members).isin(recount)]) \
+            .set_index(cls.GROUP_KEY)
+        groups = pd.concat([groups.loc[~groups.index.isin(touched)], df_new, df_recount],
+                           sort=False).reset_index()
+        df_touched = groups.loc[cls.__keys(groups).isin(touched)]
+        print(f"Special groups: {len(running)} updated, {len(recount)} recounted, "
+              f"{groups.shape[0] - len(touched)} unchanged")
+        return cls.output(df_touched), members, groups
+
+    @classmethod
+    def aggregate(cls, members):
+        """Groups of the members computed from scratch"""
+        groups = cls.__with_ranges(members).groupby(cls.GROUP_KEY, observed=True).agg(
+            MIN=("VALUE", "min"), MAX=("VALUE", "max"), SUM=("VALUE", "sum"),
+            COUNT=("VALUE", "count"), INPUTDATE=("INPUTDATE", "max"),
+            **{column: (column, "max") for column in cls.RANGE_COLUMNS}).reset_index()
+        groups[cls.RANGE_COLUMNS] = groups[cls.RANGE_COLUMNS].mask(
+            groups[cls.RANGE_COLUMNS] == "")
+        return groups.loc[:, cls.__GROUP_COLUMNS]
+
+    @classmethod
+    def __with_ranges(cls, members):
+        """
+        Members ready for the max of the range columns. These are text and
+        missing for members without ranges, groupby max() raises a TypeError
+        comparing str with None or NaN, as on the large synthetic tier where
+        some groups mix both. Missing becomes "" here, aggregate() turns it
+        back to missing.
+        """
+        members = members.copy()
+        members[cls.RANGE_COLUMNS] = members[cls.RANGE_COLUMNS].fillna("")
+        return members
+
+    @classmethod
+    def output(cls, groups):
+        """Aggregates as written to params_values, VALUE chosen by agg_function"""
+        dataframe = groups.loc[:, cls.GROUP_KEY + ["MIN", "MAX"]]
+        # running and recounted sums differ in the last bits, not in the rounded VALUE
+        dataframe["AVG"] = (groups["SUM"] / groups["COUNT"].where(groups["COUNT"] > 0)).round(10)
+        dataframe = dataframe.join(groups.loc[:, ["INPUTDATE"] + cls.RANGE_COLUMNS])
+        # select the actual VALUE
+        dataframe["VALUE"] = dataframe["MIN"]
+        dataframe.loc[dataframe["agg_function"] == "MAX", "VALUE"] = dataframe["MAX"]
+        dataframe.loc[dataframe["agg_function"] == "AVG", "VALUE"] = dataframe["AVG"]
+        dataframe["VALUE"] = dataframe["VALUE"].round(2)
+        return dataframe.reset_index(drop=True)
+
+    @classmethod
+    def __latest(cls, dataframe):
+        """Last input of every member"""
+        return dataframe.sort_values("INPUTINDEX") \
+            .drop_duplicates(subset=cls.MEMBER_KEY, keep="last")
+
+    @classmethod
+    def __keys(cls, dataframe):
+        """Group keys of the rows as an index"""
+        return pd.MultiIndex.from_frame(dataframe.loc[:, cls.GROUP_KEY])
+
+    @classmethod
+    def __groups(cls, dataframe):
+        """Distinct group keys of the rows"""
+        return cls.__keys(dataframe).unique()
@@ -1,50 +1,136 @@
-"""Saving csv files for the APR"""
+"""Saving the APR files, one per family"""
 # pylint: disable=invalid-name
 # %%
 # Imports
 import datetime as dt
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from timeit import default_timer as timer
 import pandas as pd
+from openpyxl import Workbook
 from database import DataBase as db
 
+try:
+    import xlsxwriter
+except ImportError:  # optional, APR_WRITER=xlsxwriter needs it
+    xlsxwriter = None
+
+
+# %%
+# Settings
+# xlsx (openpyxl write-only), xlsxwriter (constant memory), csv or parquet
+WRITER = os.environ.get('APR_WRITER', 'xlsx')
+WORKERS = int(os.environ.get('APR_WORKERS', str(os.cpu_count() or 1)))
+INDEX = ['PO', 'batch', 'material', 'description', 'family', 'launch_date']
+EXTENSIONS = {"xlsx": ".xlsx", "xlsxwriter": ".xlsx", "csv": ".csv", "parquet": ".parquet"}
+
 
 # %%
 # Get all the values
-PATH = os.environ['PATH_APR']
-sql = """SELECT v.PO, v.family, v.area, v.parameter, v.value,
-         o.batch, o.material, o.description, o.launch_date
-         FROM cpv.params_values v, cpv.process_orders o
-         where v.po = o.process_order"""
-df_params = db.select(sql)
-df_params["value"] = pd.to_numeric(
-    df_params["value"], errors='coerce')
-df_params.head()
+def load_values():
+    """All values with their process order"""
+    sql = """SELECT v.PO, v.family, v.area, v.parameter, v.value,
+             o.batch, o.material, o.description, o.launch_date
+             FROM cpv.params_values v, cpv.process_orders o
+             where v.po = o.process_order"""
+    df_params = db.select(sql)
+    df_params["value"] = pd.to_numeric(
+        df_params["value"], errors='coerce')
+    return df_params
+
 
 #%%
 # Save Files
-def save_files(path_base):
-    """Saves  csv files to disk"""
-    products = df_params.loc[:, "family"].unique()
-    for product in products:
-        df = df_params.loc[df_params['family'] == product]
-        df = pd.pivot_table(df, values='value',
-                            index=['PO', 'batch', 'material',
-                                   'description', 'family',
-                                   'launch_date'], columns=['parameter'])
-        #sort clumns
-        cols = sorted(df.columns.tolist())
-        df = df[cols]
-        path = path_base + "\\output\\" + product
-        filename = "\\" + product + " - " + \
-            dt.datetime.today().strftime("%Y%m%d %H%M") + ".xlsx"
-        print(path + filename)
-        if not os.path.exists(path):
-            os.makedirs(path)
-        df.to_excel(path + filename)
+def rows(df):
+    """Header and rows of the table, missing values as None"""
+    df = df.reset_index().astype(object)
+    yield list(df.columns)
+    for row in df.where(df.notna(), None).itertuples(index=False):
+        yield list(row)
+
+
+def write_xlsx(df, filename):
+    """Rows streamed to the file, only the current one is kept in memory"""
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    for row in rows(df):
+        worksheet.append(row)
+    workbook.save(filename)
+
+
+def write_xlsxwriter(df, filename):
+    """xlsxwriter in constant memory mode, every row is written once in order"""
+    if xlsxwriter is None:
+        raise ImportError("APR_WRITER=xlsxwriter needs the xlsxwriter package")
+    workbook = xlsxwriter.Workbook(filename, {"constant_memory": True,
+                                              "default_date_format": "yyyy-mm-dd hh:mm:ss"})
+    worksheet = workbook.add_worksheet()
+    for number, row in enumerate(rows(df)):
+        worksheet.write_row(number, 0, row)
+    workbook.close()
+
+
+WRITERS = {"xlsx": write_xlsx,
+           "xlsxwriter": write_xlsxwriter,
+           "csv": lambda df, filename: df.to_csv(filename),
+           "parquet": lambda df, filename: df.to_parquet(filename)}
+
+
+def save_family(product, df, path_base, writer, stamp):
+    """Pivots the values of one family and saves them, returns the timing"""
+    start = timer()
+    df = pd.pivot_table(df, values='value', index=INDEX, columns=['parameter'])
+    #sort clumns
+    cols = sorted(df.columns.tolist())
+    df = df[cols]
+    path = os.path.join(path_base, "output", product)
+    os.makedirs(path, exist_ok=True)
+    filename = os.path.join(path, f"{product} - {stamp}{EXTENSIONS[writer]}")
+    # written next to it first, a failed family leaves no half file behind
+    WRITERS[writer](df, filename + ".tmp")
+    os.replace(filename + ".tmp", filename)
+    return {"family": product, "rows": df.shape[0], "parameters": df.shape[1],
+            "seconds": round(timer() - start, 3), "file": filename}
+
+
+def save_files(df_params, path_base, writer=WRITER, workers=WORKERS):
+    """
+    Saves one file per family. The values are split by family in one groupby
+    pass and the families are pivoted and written by a pool of processes
+    (APR_WORKERS, 1 keeps everything in this process). Returns the timings.
+    """
+    if writer not in WRITERS:
+        raise ValueError(f"APR_WRITER must be one of {', '.join(WRITERS)}, not {writer}")
+    start = timer()
+    stamp = dt.datetime.today().strftime("%Y%m%d %H%M")
+    families = df_params.groupby("family", sort=False)
+    timings = []
+    if families.ngroups == 0:
+        print("No values, no family saved")
+        return timings
+    if workers <= 1:
+        for product, df in families:
+            timings.append(save_family(product, df, path_base, writer, stamp))
+            print(timings[-1]["file"])
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, families.ngroups)) as executor:
+            futures = [executor.submit(save_family, product, df, path_base, writer, stamp)
+                       for product, df in families]
+            for future in as_completed(futures):
+                timings.append(future.result())
+                print(timings[-1]["file"])
+
+    timings.sort(key=lambda timing: timing["seconds"], reverse=True)
+    for timing in timings:
+        print(f"{timing['family']}: {timing['seconds']} s, "
+              f"{timing['rows']} rows x {timing['parameters']} parameters")
+    print(f"{len(timings)} families saved as {writer} in {timer() - start:.1f} s")
+    return timings
 
 
 #%%
-save_files(PATH)
+if __name__ == "__main__":
+    save_files(load_values(), os.environ['PATH_APR'])
 
 
 #%%
@@ -0,0 +1,12 @@
+"""
+Benchmarks, run from the repository root, e.g.
+python -m benchmarks.bench_html_lookup
+
+The project modules read their connection settings at import time,
+placeholders are set here so they import without a database around.
+"""
+import os
+
+for _key in ["DB", "PORT", "HOST", "USERNAME", "PASSWORD", "XFP_DB_SID",
+             "XFP_DB_IP", "XFP_DB_PORT", "XFP_USERNAME", "XFP_PASSWORD"]:
+    os.environ.setdefault(_key, "")
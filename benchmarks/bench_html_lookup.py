@@ -0,0 +1,76 @@
+"""
+Task html lookup in Ranges.add_ranges: boolean mask scan per row
+(previous code) vs the keyed join in Ranges.lookup_html.
+The mask scan is only timed up to --max-scan rows and extrapolated.
+
+    python -m benchmarks.bench_html_lookup --sizes 1000 10000 100000 1000000
+"""
+# %%
+import argparse
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+from ranges import Ranges
+
+
+# %%
+def make_frames(rows, params_per_task=10, seed=0):
+    """Synthetic numeric parameters and the html of their tasks"""
+    rng = np.random.default_rng(seed)
+    tasks = max(rows // params_per_task, 1)
+    df_html = pd.DataFrame({"MANCODE": (1000000 + np.arange(tasks) // 50).astype(str),
+                            "BATCHID": np.arange(tasks) % 50,
+                            "OPERATIONNUMBER": np.arange(tasks) % 7,
+                            "INPUTINDEX": np.arange(tasks) % 3,
+                            "HTML": [f"<input id='{i}'>" for i in range(tasks)]})
+    task = rng.integers(0, tasks, rows)
+    dataframe = pd.DataFrame({"MANCODE": df_html["MANCODE"].values[task],
+                              "BATCHID": df_html["BATCHID"].values[task],
+                              "OPERATIONNUMBER": df_html["OPERATIONNUMBER"].values[task],
+                              "BROWSINGINDEX": df_html["INPUTINDEX"].values[task],
+                              "TAGNUMBER": rng.integers(1, 40, rows)})
+    return dataframe, df_html
+
+
+def mask_lookup(dataframe, df_html):
+    """Previous implementation, four masks over df_html per row"""
+    result = []
+    for row in dataframe.itertuples():
+        result.append(df_html.loc[(df_html["MANCODE"] == row.MANCODE)
+                                  & (df_html["BATCHID"] == row.BATCHID)
+                                  & (df_html["OPERATIONNUMBER"] == row.OPERATIONNUMBER)
+                                  & (df_html["INPUTINDEX"] == row.BROWSINGINDEX),
+                                  "HTML"].iloc[0])
+    return result
+
+
+# %%
+def run(sizes, max_scan):
+    """Time both lookups for every size"""
+    print(f"{'rows':>10} {'html rows':>10} {'mask scan s':>12} {'join s':>10} {'speedup':>9}")
+    for size in sizes:
+        dataframe, df_html = make_frames(size)
+
+        start = timer()
+        joined = Ranges.lookup_html(dataframe, df_html)
+        join_time = timer() - start
+
+        scanned = min(size, max_scan)
+        start = timer()
+        expected = mask_lookup(dataframe.iloc[:scanned], df_html)
+        scan_time = (timer() - start) * size / scanned
+        assert list(joined.iloc[:scanned]) == expected
+
+        note = "" if scanned == size else " (extrapolated)"
+        print(f"{size:>10} {df_html.shape[0]:>10} {scan_time:>12.2f} {join_time:>10.3f} "
+              f"{scan_time / join_time:>8.0f}x{note}")
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--max-scan", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.sizes, args.max_scan)
@@ -0,0 +1,114 @@
+"""
+Peak memory of a full-history run, extraction to aggregation, with the
+frames as extracted (COMPACT_DTYPES=False) and with the compact types
+of schema.Schema. Every setting runs in its own process, peak RSS only
+grows. The database writes are left out, their input is compared instead.
+
+    python -m benchmarks.bench_memory --tier large
+"""
+# %%
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+os.environ.setdefault("SPEC_CACHE", "none")
+os.environ.setdefault("REDO_EVERYTHING", "True")
+os.environ.setdefault("USE_ARCH_DB", "True")
+
+from benchmarks.run_benchmarks import TIERS  # pylint: disable=wrong-import-position
+from benchmarks import xfp_synth  # pylint: disable=wrong-import-position
+
+
+# %%
+def frames_bytes(data):
+    """Memory held by the frames of the run"""
+    return int(sum(frame.memory_usage(index=True, deep=True).sum()
+                   for frame in data.values()))
+
+
+def digest(dataframe):
+    """Hash of the rows as written to the database, in any order"""
+    from schema import Schema  # pylint: disable=import-outside-toplevel
+    dataframe = Schema.plain(dataframe).astype(object)
+    # None, NaN and NaT are all missing
+    dataframe = dataframe.where(dataframe.notna(), None).astype(str)
+    rows = sorted("\x1f".join(row) for row in dataframe.itertuples(index=False))
+    return hashlib.md5("\n".join(rows).encode()).hexdigest()
+
+
+def child(path):
+    """Run the stages here and print the measurements as json"""
+    import main  # pylint: disable=import-outside-toplevel
+    from database import DataBase as db  # pylint: disable=import-outside-toplevel
+    from metrics import Metrics  # pylint: disable=import-outside-toplevel
+    from schema import Schema  # pylint: disable=import-outside-toplevel
+
+    xfp_synth.use_standin(path)
+    df_main_list, df_special_list = xfp_synth.parameter_tables(path)
+    info = {"redo": True, "use_arch_db": True, "last_extraction": None}
+    data = {"param_list_main": Schema.apply(df_main_list),
+            "param_list_special": Schema.apply(df_special_list)}
+    stages = {}
+    for name, stage in main.STAGES:
+        if name in ("prepare", "write"):
+            continue
+        data = {key: Schema.apply(frame) for key, frame in data.items()}
+        data.update(stage(info, data))
+        stages[name] = {"frames_bytes": frames_bytes(data),
+                        "peak_rss_bytes": Metrics.peak_rss()}
+    print(json.dumps({"stages": stages,
+                      "rows": {key: data[key].shape[0]
+                               for key in ["params_main", "params_special"]},
+                      "digest": {key: digest(data[key])
+                                 for key in ["params_main", "params_special"]}}))
+
+
+def measure(path, compact):
+    """Measurements of a child process"""
+    environment = dict(os.environ, COMPACT_DTYPES=str(compact),
+                       ORDER_CACHE_PATH=os.path.join(tempfile.mkdtemp(), "orders.pkl"),
+                       STRENGTH_MEMO_PATH=os.path.join(tempfile.mkdtemp(), "memo.json"))
+    output = subprocess.run([sys.executable, "-m", "benchmarks.bench_memory",
+                             "--child", path], env=environment, check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def megabytes(value):
+    """Bytes as MB text"""
+    return "n/a" if value is None else f"{value / 2 ** 20:8.1f}"
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tier", default="large", choices=list(TIERS))
+    parser.add_argument("--data", default="bench_data")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        sys.exit(0)
+
+    data_path = os.path.join(args.data, args.tier)
+    if not os.path.exists(os.path.join(data_path, "cpv.db")):
+        print(f"Generating {args.tier} data with {TIERS[args.tier]} orders")
+        xfp_synth.generate(data_path, TIERS[args.tier])
+    results = {compact: measure(data_path, compact) for compact in [False, True]}
+
+    print(f"{'stage':<14}{'frames MB':>22}{'peak RSS MB':>24}")
+    print(f"{'':<14}{'before':>11}{'after':>11}{'before':>12}{'after':>12}")
+    for stage in results[False]["stages"]:
+        before, after = results[False]["stages"][stage], results[True]["stages"][stage]
+        print(f"{stage:<14}{megabytes(before['frames_bytes']):>11}"
+              f"{megabytes(after['frames_bytes']):>11}"
+              f"{megabytes(before['peak_rss_bytes']):>12}"
+              f"{megabytes(after['peak_rss_bytes']):>12}")
+    print(f"rows {results[True]['rows']}, same output: "
+          f"{results[False]['digest'] == results[True]['digest']}")
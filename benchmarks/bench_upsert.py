@@ -0,0 +1,136 @@
+"""
+Row by row MERGE vs staging table + set-based upsert on params_values.
+SQLite stands in for the MSSQL database, --latency adds a simulated
+network round trip to every statement sent to the server.
+
+    python -m benchmarks.bench_upsert --rows 50000 --latency 0.5
+"""
+# %%
+import argparse
+import random
+import sqlite3
+import time
+from timeit import default_timer as timer
+
+COLUMNS = ["PO", "family", "area", "parameter", "value", "unit", "inputdate",
+           "value_min", "value_max", "tolerance_min", "tolerance_max"]
+KEYS = ["PO", "family", "area", "parameter"]
+UPDATE_COLUMNS = ["unit", "inputdate", "value_min", "value_max",
+                  "tolerance_min", "tolerance_max"]
+
+
+# %%
+def create_tables(connection):
+    """params_values as in db_create_mssql.sql"""
+    connection.execute(f"""CREATE TABLE params_values (
+                {", ".join(col + " text" for col in COLUMNS)},
+                PRIMARY KEY ({", ".join(KEYS)}))""")
+    connection.execute(f"""CREATE TEMP TABLE staging (
+                {", ".join(col + " text" for col in COLUMNS)})""")
+
+
+def make_rows(count, seed=0):
+    """Synthetic params_values rows"""
+    rnd = random.Random(seed)
+    return [(f"{1000000 + i // 20}", "FAMILY" + str(i % 7), "AREA" + str(i % 3),
+             f"PARAM{i % 20}", str(round(rnd.uniform(0, 100), 2)), "mg",
+             "2019-07-04 09:00:00", "1", "99", "0", "100")
+            for i in range(count)]
+
+
+class Server:
+    """Wraps a connection and charges latency per round trip"""
+
+    def __init__(self, connection, latency):
+        self.connection = connection
+        self.latency = latency / 1000
+        self.round_trips = 0
+
+    def execute(self, sql, params=()):
+        """One statement, one round trip"""
+        self.round_trips += 1
+        time.sleep(self.latency)
+        return self.connection.execute(sql, params)
+
+    def executemany(self, sql, rows):
+        """fast_executemany sends the whole array in one round trip"""
+        self.round_trips += 1
+        time.sleep(self.latency)
+        return self.connection.executemany(sql, rows)
+
+
+# %%
+def upsert_sql(source):
+    """Upsert statement matching the params_values MERGE"""
+    sql_set = ", ".join(f"{col} = excluded.{col}" for col in UPDATE_COLUMNS)
+    return f"""INSERT INTO params_values ({", ".join(COLUMNS)})
+               {source}
+               ON CONFLICT ({", ".join(KEYS)}) DO UPDATE SET {sql_set}"""
+
+
+def row_by_row(server, rows):
+    """Current DataBase.update path, one MERGE per row"""
+    sql = upsert_sql(f"VALUES ({', '.join('?' * len(COLUMNS))})")
+    for row in rows:
+        server.execute(sql, row)
+    server.connection.commit()
+
+
+def bulk(server, rows, batch_size):
+    """DataBase.bulk_update path, staging table + one upsert per batch"""
+    sql_insert = f"INSERT INTO staging VALUES ({', '.join('?' * len(COLUMNS))})"
+    sql_matched = f"""SELECT count(*) FROM staging s JOIN params_values t ON
+                      {" and ".join(f"s.{col} = t.{col}" for col in KEYS)}"""
+    sql_merge = upsert_sql("SELECT * FROM staging WHERE true")
+    batches = []
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        server.executemany(sql_insert, batch)
+        # MERGE ... OUTPUT $action is one round trip on MSSQL
+        updated = server.connection.execute(sql_matched).fetchone()[0]
+        server.execute(sql_merge)
+        server.execute("DELETE FROM staging")
+        batches.append((len(batch) - updated, updated))
+    server.connection.commit()
+    return batches
+
+
+# %%
+def run(rows, latency, batch_size, update_share):
+    """Load the rows once, then upsert a mix of updates and inserts"""
+    results = {}
+    existing = make_rows(int(rows * update_share), seed=1)
+    incoming = make_rows(rows, seed=2)
+    for name in ["row_by_row", "bulk"]:
+        connection = sqlite3.connect(":memory:")
+        create_tables(connection)
+        connection.executemany(
+            f"INSERT INTO params_values VALUES ({', '.join('?' * len(COLUMNS))})",
+            existing)
+        server = Server(connection, latency)
+        start = timer()
+        if name == "bulk":
+            batches = bulk(server, incoming, batch_size)
+            for i, (inserted, updated) in enumerate(batches, 1):
+                print(f"  batch {i}: {inserted} inserted, {updated} updated")
+        else:
+            row_by_row(server, incoming)
+        results[name] = (timer() - start, server.round_trips)
+        connection.close()
+    for name, (seconds, round_trips) in results.items():
+        print(f"{name:>10}: {seconds:8.3f} s, {round_trips} round trips")
+    print(f"speedup: {results['row_by_row'][0] / results['bulk'][0]:.1f}x")
+    return results
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="simulated round trip in ms")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--update-share", type=float, default=0.5,
+                        help="part of the rows already in the table")
+    args = parser.parse_args()
+    run(args.rows, args.latency, args.batch_size, args.update_share)
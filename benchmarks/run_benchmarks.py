@@ -0,0 +1,210 @@
+"""
+Times the pipeline stages on synthetic XFP data across scale tiers and
+compares them with the baseline in benchmarks/baseline.json. Parameter
+extraction runs the scenarios of doc/timertests.txt: all params, 3 days and
+3 hours, on both databases and on production only, and all params keeping
+the latest input per order and parameter in the query. The stages of
+main.STAGES run as in a full run (all) and an incremental one of 3 days
+(3d), prepare reads the parameter lists of the stand-in. The write stage
+targets MSSQL, the writers are timed on the sqlite upsert of bench_upsert
+with the rows the stages give.
+
+    python -m benchmarks.run_benchmarks --tiers small medium
+    python -m benchmarks.run_benchmarks --tiers small --save-baseline
+
+Data is generated once per tier into --data, --regenerate rebuilds it.
+Exits with 1 when a stage got slower than the tolerance or its row count
+changed, stages under --min-seconds are not compared on time. The
+committed baseline was taken on one machine, its row counts hold anywhere,
+save a baseline of your own before comparing times.
+"""
+# %%
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+from timeit import default_timer as timer
+
+# ranges are extracted every time, the strength memo starts empty
+os.environ.setdefault("SPEC_CACHE", "none")
+os.environ.setdefault("STRENGTH_MEMO_PATH",
+                      os.path.join(tempfile.mkdtemp(), "strength_memo.json"))
+# main.py settings, the caches of the stages start empty on every repeat
+os.environ.setdefault("REDO_EVERYTHING", "True")
+os.environ.setdefault("USE_ARCH_DB", "True")
+os.environ.setdefault("ORDER_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "orders.pkl"))
+os.environ.setdefault("AGGREGATE_STATE_PATH",
+                      os.path.join(tempfile.mkdtemp(), "aggregate_state.pkl"))
+
+import pandas as pd  # pylint: disable=wrong-import-position
+from database import DataBase as db  # pylint: disable=wrong-import-position
+from helpers import params_list  # pylint: disable=wrong-import-position
+from ranges import Ranges  # pylint: disable=wrong-import-position
+from schema import Schema  # pylint: disable=wrong-import-position
+from xfp import Xfp as xfp  # pylint: disable=wrong-import-position
+from benchmarks import bench_upsert, xfp_synth  # pylint: disable=wrong-import-position
+import main  # pylint: disable=wrong-import-position
+
+TIERS = {"small": 100, "medium": 1000, "large": 5000}
+WINDOWS = {"3d": datetime.timedelta(days=3), "3h": datetime.timedelta(hours=3)}
+
+
+# %%
+class Timer:
+    """Runs stages repeat times and keeps the best time and the row count"""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def __call__(self, name, function, setup=None):
+        """Best time of function(*setup()), setup runs untimed before every repeat"""
+        best = None
+        for _ in range(self.repeat):
+            Ranges.get_tags.cache_clear()
+            args = setup() if setup else ()
+            start = timer()
+            result = function(*args)
+            seconds = timer() - start
+            best = seconds if best is None else min(best, seconds)
+        if isinstance(result, dict):
+            # stages give their frames
+            rows = sum(frame.shape[0] for frame in result.values())
+        else:
+            rows = result.shape[0] if hasattr(result, "shape") else len(result)
+        self.results[name] = {"seconds": round(best, 3), "rows": rows}
+        print(f"  {name:<24} {best:8.3f} s {rows:>9} rows")
+        return result
+
+
+def run_stages(scenario, info, data, timed):
+    """main.STAGES between prepare and write, each one timed on its own"""
+    data = dict(data)
+    for name, stage in main.STAGES:
+        if name in ("prepare", "write"):
+            continue
+
+        def setup():
+            # stages may change their input frames, every repeat gets its own
+            if os.path.exists(os.environ["ORDER_CACHE_PATH"]):
+                os.remove(os.environ["ORDER_CACHE_PATH"])
+            Schema.reset()
+            return dict(info), {key: Schema.apply(frame.copy()) for key, frame in data.items()}
+
+        data.update(timed(f"stage_{name}_{scenario}", stage, setup))
+    return data
+
+
+def run_tier(path, repeat, latency):
+    """All stages on the stand-in data in path"""
+    xfp_synth.use_standin(path)
+    df_main_list, df_special_list = xfp_synth.parameter_tables(path)
+    param_list = params_list(pd.concat([df_main_list["parameter"],
+                                        df_special_list["parameter"]]))
+    timed = Timer(repeat)
+
+    timed("parameters_all_both", lambda: xfp.get_parameters(redo=True, params=param_list))
+    timed("parameters_all_latest", lambda: xfp.get_parameters(
+        redo=True, params=param_list, latest=xfp.LATEST_MAIN))
+    for window, delta in WINDOWS.items():
+        since = (xfp_synth.END - delta).strftime(xfp_synth.DATE_FORMAT)
+        timed(f"parameters_{window}_both", lambda: xfp.get_parameters(
+            redo=True, time=since, params=param_list))
+        timed(f"parameters_{window}_prd", lambda: xfp.get_parameters(
+            redo=False, time=since, params=param_list))
+
+    timed("orders_both", lambda: xfp.get_orders(True))
+    timed("orders_prd", lambda: xfp.get_orders(False))
+
+    lists = {"param_list_main": df_main_list, "param_list_special": df_special_list}
+    since = (xfp_synth.END - WINDOWS["3d"]).strftime(xfp_synth.DATE_FORMAT)
+    run_stages("3d", {"redo": False, "use_arch_db": False, "last_extraction": since},
+               lists, timed)
+    data = run_stages("all", {"redo": True, "use_arch_db": True, "last_extraction": None},
+                      lists, timed)
+
+    rows = bench_upsert.make_rows(data["params_main"].shape[0] +
+                                  data["params_special"].shape[0])
+    for name, write in [("write_bulk", lambda server: bench_upsert.bulk(server, rows, 10000)),
+                        ("write_row_by_row", lambda server: bench_upsert.row_by_row(server, rows))]:
+        def run_writer(write=write):
+            connection = sqlite3.connect(":memory:")
+            bench_upsert.create_tables(connection)
+            write(bench_upsert.Server(connection, latency))
+            connection.close()
+            return rows
+        timed(name, run_writer)
+    return timed.results
+
+
+# %%
+def compare(results, baseline, tolerance, min_seconds):
+    """Print every stage against the baseline, returns the number of failures"""
+    failures = 0
+    for tier, stages in results.items():
+        print(f"{tier}:")
+        for stage, result in stages.items():
+            base = baseline.get(tier, {}).get(stage)
+            if base is None:
+                print(f"  {stage:<24} {result['seconds']:8.3f} s  not in the baseline")
+                continue
+            ratio = result["seconds"] / base["seconds"] if base["seconds"] else 1.0
+            status = ""
+            if result["rows"] != base["rows"]:
+                status = f"ROWS CHANGED from {base['rows']}"
+                failures += 1
+            elif max(result["seconds"], base["seconds"]) < min_seconds:
+                status = "too fast to compare"
+            elif ratio > 1 + tolerance:
+                status = "SLOWER"
+                failures += 1
+            elif ratio < 1 - tolerance:
+                status = "faster"
+            print(f"  {stage:<24} {result['seconds']:8.3f} s  baseline "
+                  f"{base['seconds']:8.3f} s  x{ratio:5.2f}  {status}")
+    return failures
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tiers", nargs="+", default=["small"], choices=list(TIERS))
+    parser.add_argument("--data", default="bench_data")
+    parser.add_argument("--regenerate", action="store_true")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated round trip of the writers in ms")
+    parser.add_argument("--baseline", default=os.path.join("benchmarks", "baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--min-seconds", type=float, default=0.05)
+    args = parser.parse_args()
+
+    all_results = {}
+    for tier in args.tiers:
+        path = os.path.join(args.data, tier)
+        if args.regenerate or not os.path.exists(os.path.join(path, "cpv.db")):
+            print(f"Generating {tier} data with {TIERS[tier]} orders")
+            xfp_synth.generate(path, TIERS[tier])
+        print(f"{tier}:")
+        all_results[tier] = run_tier(path, args.repeat, args.latency)
+
+    if args.save_baseline:
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                saved = json.load(file)
+        saved.update(all_results)
+        with open(args.baseline, "w") as file:
+            json.dump(saved, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as file:
+            sys.exit(1 if compare(all_results, json.load(file),
+                                  args.tolerance, args.min_seconds) else 0)
+    else:
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
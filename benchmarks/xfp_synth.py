@@ -0,0 +1,287 @@
+"""
+Synthetic XFP data: e2s_pidata_man, e2s_pitext_man, e2s_pfc_task_man and
+xfp_ofentete in sqlite files, one per schema. use_standin runs the XFP
+queries of DataBase on such a folder instead of Oracle.
+Orders launched more than --archive-days before the end are in the archive.
+params_main and params_special lists go to cpv.db.
+
+    python -m benchmarks.xfp_synth bench_data/small --orders 100
+"""
+# %%
+import argparse
+import datetime
+import functools
+import json
+import os
+import random
+import re
+import sqlite3
+import pandas as pd
+
+PRD_DB = "ELAN2406PRD"
+ARCH_DB = "ARCH2406PRD"
+END = datetime.datetime(2019, 8, 1)
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+EMI_MASTERS = [f"EMI{i}" for i in range(5)]
+BATCHES = 2
+OPERATIONS = 4
+TAGS = 8
+# datatype of every tag in a task
+NUMERIC, TEXT, DATE = 1, 0, 2
+TAG_TYPES = {1: NUMERIC, 2: NUMERIC, 3: NUMERIC, 4: NUMERIC,
+             5: TEXT, 6: DATE, 7: NUMERIC, 8: NUMERIC}
+# spec parameters entered in operation 1, referred to by the ranges of operation 2
+SPEC_TAGS = {7: "SPEC_LOW", 8: "SPEC_HIGH"}
+
+TABLES = {
+    "e2s_pidata_man": """picode integer, mancode text, batchid integer,
+        parametercode text, inputindex integer, inputdate timestamp,
+        operationnumber integer, tagnumber integer, datatype integer,
+        numvalue real, datevalue timestamp, textvalue text,
+        browsingindex integer, forced integer, cmdtext text""",
+    "e2s_pitext_man": """codefab text, batchid integer, numoperation integer,
+        inputindex integer, texte text""",
+    "e2s_pfc_task_man": """mancode text, manindex integer, taskid integer,
+        batchid integer, elementid integer, pfccode text, title text,
+        status integer""",
+    "xfp_ofentete": """numof text, codeproduit text, numlotpharma text,
+        designationproduit text, dtdatecreaparsyst timestamp, codemo text,
+        quantiteof real, uniteof text, indiceof integer, etat text"""}
+INDEXES = {"e2s_pidata_man": ["mancode", "inputdate", "parametercode"],
+           "e2s_pitext_man": ["codefab"],
+           "e2s_pfc_task_man": ["mancode"],
+           "xfp_ofentete": ["numof", "dtdatecreaparsyst"]}
+
+
+# %%
+def parameter_code(operation, tag):
+    """Parameter code of a tag, spec parameters have their own names"""
+    if operation == 1 and tag in SPEC_TAGS:
+        return SPEC_TAGS[tag]
+    return f"P{operation}{tag:02d}"
+
+
+def input_tag(rnd, operation, tag):
+    """<input> tag as the EMI html has it, numeric tags carry the ranges"""
+    if TAG_TYPES[tag] != NUMERIC or (operation == 1 and tag in SPEC_TAGS):
+        return (f'<input id="{tag}" type="text" class="emi-input" val_tolmin="null" '
+                f'val_tolmax="null" val_min="null" val_max="null"/>')
+    if operation == 2 and tag <= 2:
+        minimum, maximum = "[SPEC_LOW]", "[SPEC_HIGH]"
+    else:
+        minimum, maximum = "[80]", "[120]"
+    tolmin = "null" if rnd.random() < 0.05 else "[95]"
+    return (f'<input id="{tag}" type="text" class="emi-input" val_tolmin="{tolmin}" '
+            f'val_tolmax="[105]" val_min="{minimum}" val_max="{maximum}"/>')
+
+
+def task_html(rnd, operation):
+    """Task html with some filler around the input tags"""
+    rows = "".join(f"<tr><td class='step'>Step {tag}: check and record the value "
+                   f"as described in SOP-{rnd.randint(100, 999)}</td>"
+                   f"<td>{input_tag(rnd, operation, tag)}</td></tr>"
+                   for tag in range(1, TAGS + 1))
+    return (f"<html><head><title>Operation {operation}</title></head><body>"
+            f"<div class='task'><h1>Operation {operation}</h1>"
+            f"<p>{'Follow the instructions. ' * 20}</p>"
+            f"<table>{rows}</table></div></body></html>")
+
+
+def order_rows(rnd, number, launch, in_progress):
+    """Rows of every table for one process order"""
+    mancode = str(1000000 + number)
+    emi_master = EMI_MASTERS[number % len(EMI_MASTERS)]
+    strength = rnd.choice(["5MG", "10MG", "20 MG", "2.5MG/5MG", "OD10"])
+    rows = {table: [] for table in TABLES}
+    rows["xfp_ofentete"].append((
+        mancode, f"MAT{number % 40:04d}", f"B{number:07d}",
+        f"PRODUCT {number % 40} {strength} TABLETS", launch.strftime(DATE_FORMAT),
+        emi_master, float(rnd.randint(100, 5000)), rnd.choice(["KG", "PC"]), 0,
+        "E" if in_progress else rnd.choice(["F", "S"])))
+    picode = number * 1000
+    for batch in range(1, BATCHES + 1):
+        rows["e2s_pfc_task_man"].append((mancode, 0, batch, 0, 0, "PARENT",
+                                         f"Batch {batch}", 1))
+        for operation in range(1, OPERATIONS + 1):
+            rows["e2s_pfc_task_man"].append((mancode, 0, 100 * batch + operation, batch,
+                                             operation, f"SUB{operation}",
+                                             f"Operation {operation}", 1))
+            html = task_html(rnd, operation)
+            # html is saved once the task is completed
+            last_task = batch == BATCHES and operation == OPERATIONS
+            running = in_progress and last_task
+            if not running:
+                rows["e2s_pitext_man"].append((mancode, batch, operation, 1, html))
+            for tag in range(1, TAGS + 1):
+                inputdate = launch + datetime.timedelta(
+                    hours=batch * 6 + operation, minutes=tag)
+                # some values are entered again
+                for inputindex in range(1, 3 if rnd.random() < 0.1 else 2):
+                    picode += 1
+                    datatype = TAG_TYPES[tag]
+                    numvalue = round(rnd.gauss(100, 8), 3) if datatype == NUMERIC else None
+                    datevalue = inputdate.strftime(DATE_FORMAT) if datatype == DATE else None
+                    textvalue = rnd.choice(["OK", "NOK", " Pass "]) \
+                        if datatype == TEXT else None
+                    rows["e2s_pidata_man"].append((
+                        picode, mancode, batch, parameter_code(operation, tag),
+                        inputindex,
+                        (inputdate + datetime.timedelta(minutes=inputindex - 1))
+                        .strftime(DATE_FORMAT),
+                        operation, tag, datatype, numvalue, datevalue, textvalue,
+                        1, 0, html if running else None))
+    return rows
+
+
+def parameter_lists():
+    """params_main for operations 1 to 3, params_special groups for operation 4"""
+    main, special = [], []
+    for emi_master in EMI_MASTERS:
+        for operation in range(1, OPERATIONS):
+            for tag in range(1, TAGS + 1):
+                code = parameter_code(operation, tag)
+                main.append((emi_master, code, f"FAMILY{operation}", f"AREA{tag % 3}",
+                             f"{code} description", "mg" if TAG_TYPES[tag] == NUMERIC
+                             else None))
+        for tag in range(1, 5):
+            code = parameter_code(OPERATIONS, tag)
+            special.append((emi_master, "PARENT", f"SUB{OPERATIONS}", code,
+                            f"Operation {OPERATIONS}", f"Group {tag % 2}", tag % 2,
+                            "AREA0", f"FAMILY{OPERATIONS}",
+                            ["AVG", "MAX"][tag % 2], "mg"))
+    return main, special
+
+
+# %%
+def generate(path, orders, archive_days=180, days=400, in_progress_days=3, seed=0):
+    """Write the stand-in schemas for the given number of orders to path"""
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    connections = {}
+    for schema in [PRD_DB, ARCH_DB]:
+        file = os.path.join(path, schema + ".db")
+        if os.path.exists(file):
+            os.remove(file)
+        connection = sqlite3.connect(file)
+        for table, columns in TABLES.items():
+            connection.execute(f"CREATE TABLE {table} ({columns})")
+        connections[schema] = connection
+
+    counts = {schema: {table: 0 for table in TABLES} for schema in connections}
+    for number in range(orders):
+        # the newest order is still running at the end
+        launch = END - datetime.timedelta(days=days * (orders - 1 - number) / orders,
+                                          hours=17)
+        schema = ARCH_DB if launch < END - datetime.timedelta(days=archive_days) else PRD_DB
+        in_progress = launch > END - datetime.timedelta(days=in_progress_days)
+        for table, rows in order_rows(rnd, number, launch, in_progress).items():
+            if rows:
+                connections[schema].executemany(
+                    f"INSERT INTO {table} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+                counts[schema][table] += len(rows)
+
+    for connection in connections.values():
+        for table, columns in INDEXES.items():
+            for column in columns:
+                connection.execute(f"CREATE INDEX {table}_{column} ON {table} ({column})")
+        connection.commit()
+        connection.close()
+
+    main, special = parameter_lists()
+    file = os.path.join(path, "cpv.db")
+    if os.path.exists(file):
+        os.remove(file)
+    connection = sqlite3.connect(file)
+    connection.execute("""CREATE TABLE params_main (emi_master text, parameter text,
+                          family text, area text, description text, dataformat text)""")
+    connection.execute("""CREATE TABLE params_special (emi_master text, emi_parent text,
+                          emi_sub text, parameter text, subemi_name text, description text,
+                          groupid integer, area text, family text, agg_function text,
+                          dataformat text)""")
+    connection.executemany("INSERT INTO params_main VALUES (?, ?, ?, ?, ?, ?)", main)
+    connection.executemany("INSERT INTO params_special VALUES "
+                           "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", special)
+    connection.commit()
+    connection.close()
+    return counts
+
+
+def parameter_tables(path):
+    """params_main and params_special as from DataBase.get_param_list_*"""
+    connection = sqlite3.connect(os.path.join(path, "cpv.db"))
+    try:
+        return (pd.read_sql_query("select * from params_main", connection),
+                pd.read_sql_query("select * from params_special", connection))
+    finally:
+        connection.close()
+
+
+# %%
+# Stand-in for the XFP Oracle sessions
+class StandinCursor(sqlite3.Cursor):
+    """Oracle collection binds become json arrays read with json_each"""
+
+    def execute(self, sql, parameters=()):
+        if isinstance(parameters, dict):
+            sql = re.sub(r"select column_value from table\(:(\w+)\)",
+                         r"select value from json_each(:\1)", sql)
+            parameters = {name: json.dumps([str(key) for key in value])
+                          if isinstance(value, (list, tuple)) else value
+                          for name, value in parameters.items()}
+        return super().execute(sql, parameters)
+
+
+class StandinConnection(sqlite3.Connection):
+    """sqlite connection giving StandinCursor cursors"""
+
+    def cursor(self, factory=StandinCursor):
+        return super().cursor(factory)
+
+
+def to_char(value, value_format):
+    """TO_CHAR of the formats used in the XFP queries"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        date = datetime.datetime.strptime(value, DATE_FORMAT)
+        for part, number in [("HH24", date.hour), ("MI", date.minute), ("SS", date.second),
+                             ("YYYY", date.year), ("DD", date.day), ("MM", date.month)]:
+            value_format = value_format.replace(part, str(number).zfill(4 if part == "YYYY" else 2))
+        return value_format
+    # FM999...0.99, no trailing zeros, + 0.0 makes -0.0 plain 0
+    return f"{value + 0.0:.2f}".rstrip("0")
+
+
+def connect(path):
+    """New sqlite connection with every <schema>.db of path attached as <schema>"""
+    # columns declared as timestamp come back as datetime, as from Oracle
+    sqlite3.register_converter("timestamp", lambda value: datetime.datetime.strptime(
+        value.decode(), DATE_FORMAT))
+    connection = sqlite3.connect(":memory:", detect_types=sqlite3.PARSE_DECLTYPES,
+                                 factory=StandinConnection)
+    for name in sorted(os.listdir(path)):
+        if name.endswith(".db"):
+            connection.execute("ATTACH DATABASE ? AS ?", (os.path.join(path, name), name[:-3]))
+    # dates are kept as 'yyyy-mm-dd hh24:mi:ss' text, which compares in order
+    connection.create_function("TO_DATE", 2, lambda value, date_format: value)
+    connection.create_function("TO_CHAR", 2, to_char)
+    return connection
+
+
+def use_standin(path):
+    """XFP queries run on the sqlite files in path, None goes back to Oracle"""
+    from database import DataBase as db  # pylint: disable=import-outside-toplevel
+    db.set_xfp_connect(functools.partial(connect, path) if path else None)
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path")
+    parser.add_argument("--orders", type=int, default=100)
+    parser.add_argument("--archive-days", type=int, default=180)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for schema, tables in generate(args.path, args.orders, args.archive_days,
+                                   seed=args.seed).items():
+        print(schema, tables)
@@ -0,0 +1,115 @@
+"""Stage checkpoints of a pipeline run"""
+# %%
+import datetime
+import json
+import os
+import shutil
+import pandas as pd
+
+
+# %%
+class Checkpoint:
+    """
+    Output frames of every finished stage saved as Parquet files in
+    <root>/<run id>, with run.json listing the run settings and the
+    finished stages. A resumed run loads what is there and carries on.
+    """
+
+    def __init__(self, root, run_id, info=None, stages=None):
+        self.root = root
+        self.run_id = run_id
+        self.path = os.path.join(root, run_id)
+        self.info = info or {}
+        self.stages = stages or []
+
+    @classmethod
+    def new(cls, root, info):
+        """Start a run, the id is the local start time"""
+        run_id = datetime.datetime.now().strftime("%Y%m%dT%H%M%S")
+        checkpoint = cls(root, run_id, info)
+        os.makedirs(checkpoint.path, exist_ok=True)
+        checkpoint.__write_manifest()
+        return checkpoint
+
+    @classmethod
+    def open(cls, root, run_id=None):
+        """Run of the given id, the latest one by default, None if there is none"""
+        if run_id is None:
+            runs = cls.runs(root)
+            if not runs:
+                return None
+            run_id = runs[-1]
+        manifest = os.path.join(root, run_id, "run.json")
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest) as file:
+            saved = json.load(file)
+        return cls(root, run_id, saved["info"], saved["stages"])
+
+    @staticmethod
+    def runs(root):
+        """Ids of the saved runs, oldest first"""
+        if not os.path.isdir(root):
+            return []
+        return sorted(name for name in os.listdir(root)
+                      if os.path.exists(os.path.join(root, name, "run.json")))
+
+    @classmethod
+    def prune(cls, root, keep):
+        """Delete all but the keep latest runs, the latest one is always kept"""
+        # [:-0] would be every run, the one just written included
+        for run_id in cls.runs(root)[:-max(keep, 1)]:
+            shutil.rmtree(os.path.join(root, run_id), ignore_errors=True)
+
+    def done(self, stage):
+        """True when the stage finished in this run"""
+        return stage in self.stages
+
+    def save(self, stage, frames, **info):
+        """Save the stage output frames and mark the stage finished"""
+        for name, dataframe in frames.items():
+            path = os.path.join(self.path, f"{stage}__{name}.parquet")
+            self.to_parquet(dataframe, path + ".tmp")
+            os.replace(path + ".tmp", path)
+        self.info.update(info)
+        self.stages.append(stage)
+        self.__write_manifest()
+
+    def load(self, stage, exclude=()):
+        """Output frames of a finished stage by name, leaving out the exclude ones"""
+        prefix = f"{stage}__"
+        frames = {}
+        for name in sorted(os.listdir(self.path)):
+            if name.startswith(prefix) and name.endswith(".parquet") \
+                    and name[len(prefix):-len(".parquet")] not in exclude:
+                frames[name[len(prefix):-len(".parquet")]] = \
+                    pd.read_parquet(os.path.join(self.path, name))
+        return frames
+
+    def reset(self, stages):
+        """Forget the given stages, they run again"""
+        self.stages = [stage for stage in self.stages if stage not in stages]
+        self.__write_manifest()
+
+    @staticmethod
+    def to_parquet(dataframe, path):
+        """
+        Parquet needs one type per column, object columns mixing
+        numbers and text (e.g. VALUE) are saved as text
+        """
+        dataframe = dataframe.copy()
+        for column in dataframe.columns[dataframe.dtypes == object]:
+            if pd.api.types.infer_dtype(dataframe[column], skipna=True) \
+                    in ("mixed", "mixed-integer"):
+                dataframe[column] = dataframe[column].map(
+                    lambda value: value if value is None or isinstance(value, str)
+                    or pd.isna(value) else str(value))
+        dataframe.to_parquet(path)
+
+    def __write_manifest(self):
+        """Save run.json, replacing the file in one step"""
+        manifest = os.path.join(self.path, "run.json")
+        with open(manifest + ".tmp", "w") as file:
+            json.dump({"run_id": self.run_id, "info": self.info,
+                       "stages": self.stages}, file, indent=2, default=str)
+        os.replace(manifest + ".tmp", manifest)
@@ -0,0 +1,112 @@
+"""Run the database update periodically"""
+# %%
+import os
+import signal
+import time
+import traceback
+from timeit import default_timer as timer
+from database import DataBase as db
+from run_lock import RunLock
+from xfp import Xfp as xfp
+import main
+
+
+# %%
+class Daemon:
+    """
+    Incremental runs of main.run in one process, so the database pools and
+    the parameter catalog stay warm between cycles. The wait between cycles
+    follows the number of parameters entered in XFP since last_XFP_extraction:
+    halved while the backlog is above DAEMON_BACKLOG_ROWS, doubled while it
+    is under a quarter of it, always between the min and max interval.
+    A cycle is skipped when another run holds the lock or nothing is new,
+    a failed cycle is resumed from its checkpoints by the next one.
+
+        python daemon.py
+    """
+    __INTERVAL = int(os.environ.get('DAEMON_INTERVAL', '900'))
+    __MIN_INTERVAL = int(os.environ.get('DAEMON_MIN_INTERVAL', '60'))
+    __MAX_INTERVAL = int(os.environ.get('DAEMON_MAX_INTERVAL', '3600'))
+    __BACKLOG_ROWS = int(os.environ.get('DAEMON_BACKLOG_ROWS', '50000'))
+    # seconds before the parameter lists are read again
+    __CATALOG_TTL = int(os.environ.get('CATALOG_TTL', '3600'))
+
+    def __init__(self):
+        self.interval = self.__INTERVAL
+        self.catalog = None
+        self.catalog_time = None
+        self.failed = False
+        self.stopping = False
+
+    def stop(self, *args):
+        """Finish the cycle going on and leave"""
+        print("Stopping after the current cycle")
+        self.stopping = True
+
+    def get_catalog(self):
+        """Parameter lists, read again when older than CATALOG_TTL"""
+        if self.catalog is None or timer() - self.catalog_time > self.__CATALOG_TTL:
+            self.catalog = {"param_list_main": db.get_param_list_main(),
+                            "param_list_special": db.get_param_list_special()}
+            self.catalog_time = timer()
+        return self.catalog
+
+    def backlog(self):
+        """Parameters entered since the last extraction, None before the first one"""
+        since = db.get_key_value("last_XFP_extraction")
+        return None if since is None else xfp.count_parameters(since)
+
+    def adapt(self, backlog):
+        """Wait longer when little comes in, shorter when a lot does"""
+        if backlog is None:
+            return
+        if backlog > self.__BACKLOG_ROWS:
+            self.interval //= 2
+        elif backlog < self.__BACKLOG_ROWS / 4:
+            self.interval *= 2
+        self.interval = min(max(self.interval, self.__MIN_INTERVAL), self.__MAX_INTERVAL)
+
+    def cycle(self):
+        """One extraction, True when a run went through"""
+        backlog = self.backlog()
+        self.adapt(backlog)
+        print(f"Backlog {backlog} params, next cycle in {self.interval} s")
+        if backlog == 0 and not self.failed:
+            return False
+        lock = RunLock()
+        if not lock.acquire():
+            print("Another run is going on, skipping this cycle")
+            return False
+        try:
+            # the first run loads everything, the parameter lists included
+            redo = backlog is None and not self.failed
+            main.run(resume=self.failed, redo=redo,
+                     catalog=None if redo else self.get_catalog())
+            if redo:
+                self.catalog = None
+            self.failed = False
+        except Exception:
+            traceback.print_exc()
+            self.failed = True
+        finally:
+            lock.release()
+        return not self.failed
+
+    def serve(self):
+        """Run cycles until SIGTERM or Ctrl+C"""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.stopping:
+            start = timer()
+            try:
+                self.cycle()
+            except Exception:  # e.g. XFP not reachable, try again next cycle
+                traceback.print_exc()
+            # sleep in short steps to stop quickly
+            while not self.stopping and timer() - start < self.interval:
+                time.sleep(1)
+
+
+# %%
+if __name__ == "__main__":
+    Daemon().serve()
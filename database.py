@@ -1,9 +1,14 @@
 """Execute all the queries on the main mysql database"""
 # pylint: disable=broad-except
 # %%
+import hashlib
+import json
 import os
+import threading
 #import codecs
-from sqlalchemy import create_engine
+from distutils.util import strtobool
+from timeit import default_timer as timer
+from sqlalchemy import create_engine, event
 from sqlalchemy.sql import text
 import pandas as pd
 import cx_Oracle
@@ -23,34 +28,343 @@ class DataBase:
     __DB_XFP_PORT = os.environ['XFP_DB_PORT']
     __USERNAME_XFP = os.environ['XFP_USERNAME']
     __PASSWORD_XFP = os.environ['XFP_PASSWORD']
+    __BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '10000'))
+    # compare row fingerprints and write only new or changed rows
+    __SKIP_UNCHANGED = bool(strtobool(os.environ.get('SKIP_UNCHANGED', 'True')))
+    __POOL_SIZE = int(os.environ.get('POOL_SIZE', '5'))
+    __POOL_MAX_OVERFLOW = int(os.environ.get('POOL_MAX_OVERFLOW', '5'))
+    __POOL_RECYCLE = int(os.environ.get('POOL_RECYCLE', '3600'))
+    __XFP_POOL_MIN = int(os.environ.get('XFP_POOL_MIN', '1'))
+    __XFP_POOL_MAX = int(os.environ.get('XFP_POOL_MAX', '4'))
+    __XFP_POOL_PING_INTERVAL = int(os.environ.get('XFP_POOL_PING_INTERVAL', '60'))
+    __XFP_ARRAYSIZE = int(os.environ.get('XFP_ARRAYSIZE', '5000'))
+    __XFP_CHUNKSIZE = int(os.environ.get('XFP_CHUNKSIZE', '100000'))
+    # unbounded nested table of varchar2 available on every Oracle database
+    __XFP_KEY_COLLECTION = "SYS.DBMS_DEBUG_VC2COLL"
+    # connection factory used instead of the XFP pool, see set_xfp_connect
+    __XFP_CONNECT = None
+
+    # process wide pooled resources, created on first use
+    __ENGINE = None
+    __XFP_POOL = None
+    __POOL_LOCK = threading.Lock()
+    __POOL_STATS = {"mssql": {"checkouts": 0, "hits": 0, "misses": 0, "wait": 0.0},
+                    "xfp": {"checkouts": 0, "hits": 0, "misses": 0, "wait": 0.0}}
+    __SKIPPED = {}
+    # tables known to have the row_hash column
+    __HASHED = set()
+    __XFP_FETCHED = {"rows": 0, "bytes": 0}
+
+    # dataframe column -> table column, in the table column order
+    __PARAMS_VALUES_COLUMNS = {"MANCODE": "PO",
+                               "family": "family",
+                               "area": "area",
+                               "description": "parameter",
+                               "VALUE": "value",
+                               "dataformat": "unit",
+                               "INPUTDATE": "inputdate",
+                               "value_min": "value_min",
+                               "value_max": "value_max",
+                               "tolerance_min": "tolerance_min",
+                               "tolerance_max": "tolerance_max"}
+    __PROCESS_ORDERS_COLUMNS = {"PO": "process_order",
+                                "BATCH": "batch",
+                                "MATERIAL": "material",
+                                "DESCRIPTION": "description",
+                                "PO_LAUNCHDATE": "launch_date",
+                                "ORDER_QTY": "order_quantity",
+                                "UNIT": "order_unit",
+                                "STRENGTH": "strength"}
+    __SPEC_RANGES_COLUMNS = {"MANCODE": "mancode",
+                             "BATCHID": "batchid",
+                             "OPERATIONNUMBER": "operationnumber",
+                             "INPUTINDEX": "inputindex",
+                             "TAGNUMBER": "tagnumber",
+                             "value_min": "value_min",
+                             "value_max": "value_max",
+                             "tolerance_min": "tolerance_min",
+                             "tolerance_max": "tolerance_max",
+                             "in_progress": "in_progress"}
 
     @classmethod
     def get_engine(cls):
-        """"Returns database engin"""
-        return create_engine(
-            f"mssql+pyodbc://{cls.__USERNAME}:{cls.__PASSWORD}@{cls.__HOST}:{cls.__PORT}/{cls.__DB}?driver=ODBC+Driver+17+for+SQL+Server",
-            isolation_level="READ COMMITTED")
+        """"Returns database engin, one pooled engine per process"""
+        with cls.__POOL_LOCK:
+            if cls.__ENGINE is None:
+                engine = create_engine(
+                    f"mssql+pyodbc://{cls.__USERNAME}:{cls.__PASSWORD}@{cls.__HOST}:{cls.__PORT}/{cls.__DB}?driver=ODBC+Driver+17+for+SQL+Server",
+                    isolation_level="READ COMMITTED",
+                    pool_size=cls.__POOL_SIZE,
+                    max_overflow=cls.__POOL_MAX_OVERFLOW,
+                    pool_recycle=cls.__POOL_RECYCLE,
+                    pool_pre_ping=True)
+                # new DBAPI connection means the pool had nothing to give
+                event.listen(engine, "connect",
+                             lambda *args: cls.__count_pool("mssql", miss=True))
+                cls.__ENGINE = engine
+        return cls.__ENGINE
+
+    @classmethod
+    def get_xfp_pool(cls):
+        """Returns XFP session pool, one per process"""
+        with cls.__POOL_LOCK:
+            if cls.__XFP_POOL is None:
+                dsn = cx_Oracle.makedsn(cls.__DB_XFP_IP,
+                                        cls.__DB_XFP_PORT,
+                                        cls.__DB_XFP_SID)
+                pool = cx_Oracle.SessionPool(cls.__USERNAME_XFP,
+                                             cls.__PASSWORD_XFP,
+                                             dsn,
+                                             min=cls.__XFP_POOL_MIN,
+                                             max=cls.__XFP_POOL_MAX,
+                                             increment=1,
+                                             threaded=True,
+                                             getmode=cx_Oracle.SPOOL_ATTRVAL_WAIT,
+                                             encoding="UTF-8", nencoding="UTF-8")
+                # sessions idle longer than this are pinged before reuse
+                if hasattr(pool, "ping_interval"):
+                    pool.ping_interval = cls.__XFP_POOL_PING_INTERVAL
+                cls.__XFP_POOL = pool
+        return cls.__XFP_POOL
+
+    @classmethod
+    def __count_pool(cls, name, miss=False, wait=None):
+        """Update pool statistics"""
+        with cls.__POOL_LOCK:
+            stats = cls.__POOL_STATS[name]
+            if miss:
+                stats["misses"] += 1
+            if wait is not None:
+                stats["checkouts"] += 1
+                stats["wait"] += wait
+            stats["hits"] = max(stats["checkouts"] - stats["misses"], 0)
+
+    @classmethod
+    def connect(cls):
+        """Checkout a connection from the MSSQL pool"""
+        start = timer()
+        connection = cls.get_engine().connect()
+        cls.__count_pool("mssql", wait=timer() - start)
+        return connection
+
+    @classmethod
+    def set_xfp_connect(cls, connect):
+        """
+        XFP sessions come from connect() instead of the Oracle pool, e.g.
+        the sqlite stand-in of benchmarks/xfp_synth.py. Binds are passed
+        as given, the connection binds the lists itself. None goes back to Oracle.
+        """
+        cls.__XFP_CONNECT = connect
+
+    @classmethod
+    def xfp_acquire(cls):
+        """Checkout a session from the XFP pool, release it with xfp_release"""
+        if cls.__XFP_CONNECT is not None:
+            return cls.__XFP_CONNECT()
+        pool = cls.get_xfp_pool()
+        start = timer()
+        opened = pool.opened
+        connection = pool.acquire()
+        cls.__count_pool("xfp", miss=pool.opened > opened, wait=timer() - start)
+        return connection
+
+    @classmethod
+    def xfp_release(cls, connection):
+        """Give the session back to the XFP pool"""
+        if cls.__XFP_CONNECT is not None:
+            connection.close()
+            return
+        cls.get_xfp_pool().release(connection)
+
+    @classmethod
+    def pool_stats(cls):
+        """Pool hit/miss/wait statistics for both databases"""
+        with cls.__POOL_LOCK:
+            stats = {name: dict(values) for name, values in cls.__POOL_STATS.items()}
+        if cls.__ENGINE is not None:
+            stats["mssql"]["status"] = cls.__ENGINE.pool.status()
+        if cls.__XFP_POOL is not None:
+            stats["xfp"]["opened"] = cls.__XFP_POOL.opened
+            stats["xfp"]["busy"] = cls.__XFP_POOL.busy
+        return stats
 
     @classmethod
     def update(cls, statement, dataframe):
         """Execute Insert or Update SQL statement on the database"""
         dataframe = trim_all_columns(dataframe)
         dataframe = dataframe.fillna(value="")
-        engine = cls.get_engine()
-        connection = engine.connect()
-        connection.fast_executemany = False
-        with connection.begin() as transaction:
-            try:
-                for row in dataframe.itertuples():
-                    connection.execute(statement, **row._asdict())
-            except Exception as e:
-                print(e)
-                transaction.rollback()
-
-    @classmethod
-    def update_params_values(cls, dataframe):
+        with cls.connect() as connection:
+            connection.fast_executemany = False
+            with connection.begin() as transaction:
+                try:
+                    for row in dataframe.itertuples():
+                        connection.execute(statement, **row._asdict())
+                except Exception as e:
+                    print(e)
+                    # the write stage must fail, else the run counts the rows as saved
+                    transaction.rollback()
+                    raise
+
+    @classmethod
+    def bulk_update(cls, table, columns, keys, dataframe, update_columns=None):
+        """
+        Set-based upsert. Rows are loaded in batches into a staging table
+        and each batch is applied to the table with a single MERGE.
+        columns maps dataframe columns to table columns, keys are the table
+        columns to match on and update_columns the ones set when matched.
+        Returns inserted and updated counts per batch, a failing batch rolls
+        back all of them and raises.
+        """
+        dataframe = trim_all_columns(dataframe)
+        dataframe = dataframe.fillna(value="")
+        dataframe = dataframe.loc[:, list(columns)].rename(columns=columns)
+        # MERGE fails when the same key comes twice in one source
+        dataframe = dataframe.drop_duplicates(subset=keys, keep="last")
+        if update_columns is None:
+            update_columns = [col for col in dataframe.columns if col not in keys]
+
+        col_list = ", ".join(dataframe.columns)
+        sql_stage = f"SELECT TOP 0 {col_list} INTO #staging FROM {table}"
+        sql_insert = f"""INSERT INTO #staging ({col_list})
+                        VALUES ({', '.join('?' * dataframe.shape[1])})"""
+        sql_on = " and ".join(f"source.{col} = target.{col}" for col in keys)
+        sql_matched = ""
+        if update_columns:
+            sql_set = ", ".join(f"target.{col} = source.{col}" for col in update_columns)
+            sql_matched = f"WHEN MATCHED THEN UPDATE SET {sql_set}"
+        sql_merge = f"""SET NOCOUNT ON;
+            DECLARE @actions TABLE (action nvarchar(10));
+            MERGE {table} AS target USING #staging AS source
+            ON ({sql_on})
+            {sql_matched}
+            WHEN NOT MATCHED by target
+                THEN INSERT ({col_list})
+                VALUES ({', '.join('source.' + col for col in dataframe.columns)})
+            OUTPUT $action INTO @actions;
+            SELECT COALESCE(SUM(CASE WHEN action = 'INSERT' THEN 1 ELSE 0 END), 0),
+                   COALESCE(SUM(CASE WHEN action = 'UPDATE' THEN 1 ELSE 0 END), 0)
+            FROM @actions;"""
+
+        batches = []
+        start = timer()
+        connection = cls.get_engine().raw_connection()
+        cls.__count_pool("mssql", wait=timer() - start)
+        try:
+            cursor = connection.cursor()
+            cursor.fast_executemany = True
+            cursor.execute(sql_stage)
+            for start in range(0, dataframe.shape[0], cls.__BULK_BATCH_SIZE):
+                df_batch = dataframe.iloc[start:start + cls.__BULK_BATCH_SIZE]
+                batch_start = timer()
+                # object dtype so pyodbc gets python scalars, not numpy ones
+                cursor.executemany(sql_insert, list(df_batch.astype(object)
+                                                    .itertuples(index=False, name=None)))
+                cursor.execute(sql_merge)
+                inserted, updated = cursor.fetchone()
+                cursor.execute("TRUNCATE TABLE #staging")
+                batches.append({"batch": len(batches) + 1,
+                                "rows": df_batch.shape[0],
+                                "inserted": inserted,
+                                "updated": updated,
+                                "seconds": round(timer() - batch_start, 3)})
+                print(f"{table} batch {len(batches)}: {inserted} inserted, "
+                      f"{updated} updated")
+            cursor.execute("DROP TABLE #staging")
+            connection.commit()
+        except Exception as e:
+            print(e)
+            # nothing of the batches is kept, the caller must not count them
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        return pd.DataFrame(batches, columns=["batch", "rows", "inserted",
+                                              "updated", "seconds"])
+
+    @staticmethod
+    def row_hash(dataframe):
+        """Fingerprint of every row, md5 of the values as text"""
+        values = dataframe.astype(str)
+        joined = pd.Series("", index=dataframe.index)
+        for col in values.columns:
+            joined = joined + "\x1f" + values[col]
+        return joined.map(lambda value: hashlib.md5(value.encode("utf-8")).hexdigest())
+
+    @classmethod
+    def check_row_hash(cls, table):
+        """Fails when the table has no row_hash column yet, checked once per process"""
+        if table in cls.__HASHED:
+            return
+        with cls.connect() as connection:
+            length = connection.execute(text("select COL_LENGTH(:table, 'row_hash')"),
+                                        table=table).scalar()
+        if length is None:
+            raise RuntimeError(f"{table} has no row_hash column, run the "
+                               "row_hash migration of db_create_mssql.sql")
+        with cls.__POOL_LOCK:
+            cls.__HASHED.add(table)
+
+    @classmethod
+    def changed_rows(cls, table, columns, keys, dataframe):
+        """
+        Adds the ROW_HASH fingerprint of the columns to write and leaves out
+        the rows whose fingerprint is already stored in the table.
+        Stored fingerprints are read in one query, selected by the first key.
+        columns maps dataframe columns to table columns, keys are table columns.
+        Of rows with the same keys only the last is kept, as both writes do.
+        """
+        dataframe = trim_all_columns(dataframe).fillna(value="")
+        # else the stored fingerprint matches one of them and the other is written
+        key_columns = [col for col, name in columns.items() if name in keys]
+        dataframe = dataframe.drop_duplicates(subset=key_columns, keep="last")
+        dataframe = dataframe.assign(ROW_HASH=cls.row_hash(dataframe.loc[:, list(columns)]))
+        # both writes store the fingerprint, also when nothing is skipped
+        cls.check_row_hash(table)
+        if not cls.__SKIP_UNCHANGED or dataframe.empty:
+            return dataframe
+
+        df_keys = dataframe.loc[:, list(columns)].rename(columns=columns) \
+            .loc[:, keys].astype(str)
+        query = text(f"""select {", ".join(keys)}, row_hash from {table}
+                    where {keys[0]} in (select value from openjson(:keys))""")
+        df_stored = cls.select(query, {"keys": json.dumps(df_keys[keys[0]].unique().tolist())})
+        stored = df_keys.merge(df_stored.astype({key: str for key in keys}),
+                               how="left", on=keys)["row_hash"].values
+        changed = stored != dataframe["ROW_HASH"].values
+
+        skipped = int((~changed).sum())
+        name = table.split(".")[-1]
+        with cls.__POOL_LOCK:
+            cls.__SKIPPED[name] = cls.__SKIPPED.get(name, 0) + skipped
+        print(f"{name}: {skipped} unchanged rows skipped, {int(changed.sum())} to write")
+        return dataframe.loc[changed]
+
+    @classmethod
+    def skipped_rows(cls):
+        """Unchanged rows left out per table since the start or the last reset"""
+        with cls.__POOL_LOCK:
+            return dict(cls.__SKIPPED)
+
+    @classmethod
+    def reset_skipped_rows(cls):
+        """Count skipped rows from zero, at the start of a run"""
+        with cls.__POOL_LOCK:
+            cls.__SKIPPED = {}
+
+    @classmethod
+    def update_params_values(cls, dataframe, bulk=False):
         """Execute Insert or Update SQL statement on the database"""
         table = f"{cls.__DB}.dbo.params_values"
+        keys = ["PO", "family", "area", "parameter"]
+        dataframe = cls.changed_rows(table, cls.__PARAMS_VALUES_COLUMNS, keys, dataframe)
+        if bulk:
+            return cls.bulk_update(table, dict(cls.__PARAMS_VALUES_COLUMNS,
+                                               ROW_HASH="row_hash"),
+                                   keys, dataframe,
+                                   update_columns=["value", "unit", "inputdate",
+                                                   "value_min", "value_max",
+                                                   "tolerance_min", "tolerance_max",
+                                                   "row_hash"])
         statement = text(f"""MERGE {table} AS target USING
             (SELECT :MANCODE,
                     :family,
@@ -62,7 +376,8 @@ class DataBase:
                     :value_min,
                     :value_max,
                     :tolerance_min,
-                    :tolerance_max) AS source
+                    :tolerance_max,
+                    :ROW_HASH) AS source
                 (PO,
                     family,
                     area,
@@ -73,21 +388,27 @@ class DataBase:
                     value_min,
                     value_max,
                     tolerance_min,
-                    tolerance_max)
+                    tolerance_max,
+                    row_hash)
             ON (source.PO = target.PO and
                 source.family = target.family and
                 source.area = target.area and
                 source.parameter = target.parameter)
             WHEN MATCHED
                 THEN UPDATE SET
+                        target.value = source.value,
                         target.unit = source.unit,
                         target.inputdate = source.inputdate,
                         target.value_min = source.value_min,
                         target.value_max = source.value_max,
                         target.tolerance_min = source.tolerance_min,
-                        target.tolerance_max = source.tolerance_max
+                        target.tolerance_max = source.tolerance_max,
+                        target.row_hash = source.row_hash
             WHEN NOT MATCHED by target
-                THEN INSERT VALUES
+                THEN INSERT (PO, family, area, parameter, value, unit, inputdate,
+                             value_min, value_max, tolerance_min, tolerance_max,
+                             row_hash)
+                VALUES
                     (:MANCODE,
                     :family,
                     :area,
@@ -98,13 +419,20 @@ class DataBase:
                     :value_min,
                     :value_max,
                     :tolerance_min,
-                    :tolerance_max);""")
+                    :tolerance_max,
+                    :ROW_HASH);""")
         cls.update(statement, dataframe)
 
     @classmethod
-    def update_process_orders(cls, dataframe):
+    def update_process_orders(cls, dataframe, bulk=False):
         """Execute Insert or Update SQL statement on the database"""
         table = f"{cls.__DB}.dbo.process_orders"
+        dataframe = cls.changed_rows(table, cls.__PROCESS_ORDERS_COLUMNS,
+                                     ["process_order"], dataframe)
+        if bulk:
+            return cls.bulk_update(table, dict(cls.__PROCESS_ORDERS_COLUMNS,
+                                               ROW_HASH="row_hash"),
+                                   ["process_order"], dataframe)
         statement = text(f"""MERGE {table} AS target USING
                     (SELECT :PO,
                             :BATCH,
@@ -113,7 +441,8 @@ class DataBase:
                             :PO_LAUNCHDATE,
                             :ORDER_QTY,
                             :UNIT,
-                            :STRENGTH) AS source
+                            :STRENGTH,
+                            :ROW_HASH) AS source
                         (process_order,
                             batch,
                             material,
@@ -121,7 +450,8 @@ class DataBase:
                             launch_date,
                             order_quantity,
                             order_unit,
-                            strength)
+                            strength,
+                            row_hash)
                     ON (source.process_order = target.process_order)
                     WHEN MATCHED
                         THEN UPDATE SET
@@ -131,9 +461,13 @@ class DataBase:
                             target.launch_date = source.launch_date,
                             target.order_quantity = source.order_quantity,
                             target.order_unit = source.order_unit,
-                            target.strength = source.strength
+                            target.strength = source.strength,
+                            target.row_hash = source.row_hash
                     WHEN NOT MATCHED by target
-                        THEN INSERT VALUES
+                        THEN INSERT (process_order, batch, material, description,
+                                     launch_date, order_quantity, order_unit,
+                                     strength, row_hash)
+                        VALUES
                             (:PO,
                             :BATCH,
                             :MATERIAL,
@@ -141,20 +475,42 @@ class DataBase:
                             :PO_LAUNCHDATE,
                             :ORDER_QTY,
                             :UNIT,
-                            :STRENGTH);""")
+                            :STRENGTH,
+                            :ROW_HASH);""")
         cls.update(statement, dataframe)
 
     @classmethod
-    def select(cls, query):
+    def get_spec_ranges(cls, mancodes):
+        """Cached spec ranges of the given process orders"""
+        # orders go as one json parameter, the statement text stays the same
+        query = text(f"""select mancode as MANCODE, batchid as BATCHID,
+                    operationnumber as OPERATIONNUMBER,
+                    inputindex as INPUTINDEX, tagnumber as TAGNUMBER,
+                    value_min, value_max, tolerance_min, tolerance_max,
+                    in_progress
+                    from {cls.__DB}.dbo.spec_ranges
+                    where mancode in (select value from openjson(:orders))""")
+        orders = json.dumps([str(mancode) for mancode in pd.unique(mancodes)])
+        return cls.select(query, {"orders": orders})
+
+    @classmethod
+    def update_spec_ranges(cls, dataframe):
+        """Save extracted spec ranges to the cache table"""
+        table = f"{cls.__DB}.dbo.spec_ranges"
+        return cls.bulk_update(table, cls.__SPEC_RANGES_COLUMNS,
+                               ["mancode", "batchid", "operationnumber",
+                                "inputindex", "tagnumber"], dataframe)
+
+    @classmethod
+    def select(cls, query, params=None):
         """Return dataframe from SQL"""
-        engine = cls.get_engine()
-        connection = engine.connect()
-        with connection.begin() as transaction:
-            try:
-                dataframe = pd.read_sql(query, connection)
-            except Exception as e:
-                print(e)
-                transaction.rollback()
+        with cls.connect() as connection:
+            with connection.begin() as transaction:
+                try:
+                    dataframe = pd.read_sql(query, connection, params=params)
+                except Exception as e:
+                    print(e)
+                    transaction.rollback()
         return dataframe
 
     @classmethod
@@ -183,57 +539,108 @@ class DataBase:
                     WHEN NOT MATCHED by target
                         THEN INSERT VALUES
                             (:key, :value);""")
-        engine = cls.get_engine()
-        connection = engine.connect()
-        with connection.begin() as transaction:
-            try:
-                connection.execute(
-                    statement, key=key, value=value)
-            except Exception as e:
-                print(e)
-                transaction.rollback()
-
-    @classmethod
-    def get_key_value(cls, key):
-        """get the last extraction time"""
+        with cls.connect() as connection:
+            with connection.begin() as transaction:
+                try:
+                    connection.execute(
+                        statement, key=key, value=value)
+                except Exception as e:
+                    print(e)
+                    transaction.rollback()
+                    raise
+
+    @classmethod
+    def get_key_value(cls, key, default=None):
+        """get the last extraction time, default when the key is not saved yet"""
         query = f"select value FROM {cls.__DB}.dbo.key_values where keyname = \
                 '{key}'"
-        return cls.select(query).iloc[0]["value"]
+        dataframe = cls.select(query)
+        return default if dataframe.empty else dataframe.iloc[0]["value"]
 
     @classmethod
-    def xfp_run_sql(cls, query):
+    def xfp_run_sql(cls, query, chunksize=None, binds=None, trim=True):
         """Runs select and returns dataframe"""
+        dataframe = pd.concat(cls.xfp_run_sql_chunks(query, chunksize, binds=binds, trim=trim),
+                              ignore_index=True, sort=False)
+        dataframe.attrs["trimmed"] = True
+        return dataframe
+
+    @classmethod
+    def xfp_run_sql_chunks(cls, query, chunksize=None, arraysize=None, prefetch=None,
+                           binds=None, trim=True):
+        """
+        Runs select and yields dataframes of at most chunksize rows.
+        arraysize and prefetch set how many rows each round trip brings.
+        binds are bind variables, lists are bound as a collection to be
+        used with helpers.key_filter.
+        trim=False when the query trims text with TRIM() itself.
+        At least one, possibly empty, dataframe is yielded.
+        """
+        chunksize = chunksize or cls.__XFP_CHUNKSIZE
+        arraysize = arraysize or min(cls.__XFP_ARRAYSIZE, chunksize)
+
         # https://stackoverflow.com/questions/49288724/read-and-write-clob-data-using-python-and-cx-oracle
         def OutputTypeHandler(cursor, name, defaultType, size, precision, scale):
             if defaultType == cx_Oracle.CLOB:
                 return cursor.var(cx_Oracle.LONG_STRING, arraysize=cursor.arraysize)
             elif defaultType == cx_Oracle.BLOB:
                 return cursor.var(cx_Oracle.LONG_BINARY, arraysize=cursor.arraysize)
+
+        connection = cls.xfp_acquire()
         try:
-            connection_string = cx_Oracle.makedsn(cls.__DB_XFP_IP,
-                                                  cls.__DB_XFP_PORT,
-                                                  cls.__DB_XFP_SID)
-            connection = cx_Oracle.connect(cls.__USERNAME_XFP,
-                                           cls.__PASSWORD_XFP,
-                                        connection_string, encoding="UTF-8", nencoding="UTF-8")
-            connection.outputtypehandler = OutputTypeHandler
             cursor = connection.cursor()
-            cursor.execute(query)
-            col_names = [row[0] for row in cursor.description]
-            dataframe = pd.DataFrame(cursor.fetchall(), columns=col_names)
+            cursor.arraysize = arraysize
+            binds = dict(binds or {})
+            if cls.__XFP_CONNECT is None:
+                connection.outputtypehandler = OutputTypeHandler
+                if hasattr(cursor, "prefetchrows"):  # cx_Oracle 8+
+                    cursor.prefetchrows = prefetch or arraysize
+                for name, value in binds.items():
+                    if isinstance(value, (list, tuple)):
+                        binds[name] = connection.gettype(cls.__XFP_KEY_COLLECTION) \
+                            .newobject([str(key) for key in value])
+            cursor.execute(query, binds)
+            # Oracle gives unquoted names in upper case
+            col_names = [row[0].upper() for row in cursor.description]
+            first = True
+            while True:
+                rows = cursor.fetchmany(chunksize)
+                if not rows and not first:
+                    break
+                first = False
+                dataframe = pd.DataFrame(rows, columns=col_names)
+                cls.__count_fetched(dataframe)
+                if trim:
+                    dataframe = trim_all_columns(dataframe)
+                dataframe.attrs["trimmed"] = True
+                yield dataframe
+                if len(rows) < chunksize:
+                    break
         except cx_Oracle.DatabaseError as e:
             print(e)
             print(query)
             raise
         finally:
-            connection.close()
-        return trim_all_columns(dataframe)
+            cls.xfp_release(connection)
+
+    @classmethod
+    def __count_fetched(cls, dataframe):
+        """Add a fetched chunk to the totals, bytes as held in memory"""
+        size = int(dataframe.memory_usage(index=False, deep=True).sum())
+        with cls.__POOL_LOCK:
+            cls.__XFP_FETCHED["rows"] += dataframe.shape[0]
+            cls.__XFP_FETCHED["bytes"] += size
+
+    @classmethod
+    def xfp_fetched(cls):
+        """Rows and bytes fetched from XFP since the start"""
+        with cls.__POOL_LOCK:
+            return dict(cls.__XFP_FETCHED)
 
     @classmethod
     def truncate_tables(cls, params, values):
         """When doing full upload delete all rows before insert"""
         statements_params, statements_values = [], []
-        engine = cls.get_engine()
 
         if params:
             statements_params = [f"TRUNCATE TABLE {cls.__DB}.dbo.params_special",
@@ -244,11 +651,12 @@ class DataBase:
 
         statements = statements_params + statements_values
 
-        connection = engine.connect()
-        with connection.begin() as transaction:
-            try:
-                for statement in statements:
-                    connection.execute(statement)
-            except Exception as e:
-                print(e)
-                transaction.rollback()
+        with cls.connect() as connection:
+            with connection.begin() as transaction:
+                try:
+                    for statement in statements:
+                        connection.execute(statement)
+                except Exception as e:
+                    print(e)
+                    transaction.rollback()
+                    raise
@@ -239,6 +239,7 @@ CREATE TABLE [dbo].[params_values](
 	[value_max] [varchar](30) NULL,
 	[tolerance_min] [varchar](30) NULL,
 	[tolerance_max] [varchar](30) NULL,
+	[row_hash] [char](32) NULL,
 PRIMARY KEY CLUSTERED
 (
 	[PO] ASC,
@@ -264,6 +265,12 @@ GO
 ALTER TABLE [dbo].[params_values] ADD  DEFAULT (NULL) FOR [tolerance_max]
 GO
 
+/* databases created before row_hash, DataBase.check_row_hash stops the write until this ran */
+IF COL_LENGTH('dbo.params_values', 'row_hash') IS NULL
+    ALTER TABLE [dbo].[params_values] ADD [row_hash] [char](32) NULL
+GO
+
+
 
 
 
@@ -291,6 +298,7 @@ CREATE TABLE [dbo].[process_orders](
 	[order_quantity] [decimal](10, 0) NOT NULL,
 	[order_unit] [varchar](2) NOT NULL,
 	[strength] [decimal](10, 0) NULL,
+	[row_hash] [char](32) NULL,
 PRIMARY KEY CLUSTERED
 (
 	[process_order] ASC
@@ -298,14 +306,41 @@ PRIMARY KEY CLUSTERED
 ) ON [PRIMARY]
 GO
 
+/* databases created before row_hash */
+IF COL_LENGTH('dbo.process_orders', 'row_hash') IS NULL
+    ALTER TABLE [dbo].[process_orders] ADD [row_hash] [char](32) NULL
+GO
 
 
 
+USE [cpv_dev]
+GO
 
+/****** Object:  Table [dbo].[spec_ranges]    Cache of ranges extracted from task html ******/
+SET ANSI_NULLS ON
+GO
 
+SET QUOTED_IDENTIFIER ON
+GO
 
-
-
-
-
-
+CREATE TABLE [dbo].[spec_ranges](
+	[mancode] [varchar](10) NOT NULL,
+	[batchid] [varchar](16) NOT NULL,
+	[operationnumber] [varchar](16) NOT NULL,
+	[inputindex] [varchar](16) NOT NULL,
+	[tagnumber] [varchar](16) NOT NULL,
+	[value_min] [varchar](30) NULL,
+	[value_max] [varchar](30) NULL,
+	[tolerance_min] [varchar](30) NULL,
+	[tolerance_max] [varchar](30) NULL,
+	[in_progress] [bit] NOT NULL,
+PRIMARY KEY CLUSTERED
+(
+	[mancode] ASC,
+	[batchid] ASC,
+	[operationnumber] ASC,
+	[inputindex] ASC,
+	[tagnumber] ASC
+)WITH (PAD_INDEX = OFF, STATISTICS_NORECOMPUTE = OFF, IGNORE_DUP_KEY = OFF, ALLOW_ROW_LOCKS = ON, ALLOW_PAGE_LOCKS = ON) ON [PRIMARY]
+) ON [PRIMARY]
+GO
@@ -3,17 +3,34 @@
 # %%
 
 
-def create_sql_snippet(keyword, labels, df):
-    """Create sql text, order of labels and columns must align"""
+def key_filter(keyword, labels, bind):
+    """
+    SQL predicate matching the labels against keys bound as a collection,
+    several labels are compared as one text key, see key_values, each
+    trimmed like the select lists. A single label is compared as it is so
+    its index is used, it must be a VARCHAR2 column: a padded CHAR column
+    would not equal the trimmed key.
+    """
+    if len(labels) == 1:
+        expression = labels[0]
+    else:
+        expression = " || '|' || ".join(f"trim({label})" for label in labels)
+    return f"{keyword} {expression} in (select column_value from table(:{bind}))\n"
+
+
+def key_text(column):
+    """Key column as text the way Oracle converts it, 12.0 becomes '12'"""
+    return column.astype(object).map(lambda value: str(int(value))
+                      if isinstance(value, float) and value.is_integer()
+                      else str(value))
 
-    txt = ""
-    for row in df.itertuples():
-        txt_temp = ""
-        for i, label in enumerate(labels, start=1):
-            txt_temp += f" and {label} = '{row[i]}'"
-        txt = txt + txt_temp[4:]
-        txt += f")\nor ("
-    return f"{keyword} (({txt[:-5]})"
+
+def key_values(df, labels):
+    """Unique keys of the df columns for a key_filter bind"""
+    keys = key_text(df[labels[0]])
+    for label in labels[1:]:
+        keys = keys + "|" + key_text(df[label])
+    return keys.unique().tolist()
 
 
 def is_string_digit(value):
@@ -27,47 +44,40 @@ def is_string_digit(value):
         return False
 
 
-def format_params_list(column, df_special=None):
+def params_list(column, df_special=None):
     """
-    Format the parameter list for the SQL query,
-    Note the Oracle max list size is 1000 elements
+    Unique values of the column as a list for a key_filter bind,
+    None when there are none. With df_special all parameters of
+    the same groups are included.
     """
-    params = ""
-    list1000 = []
     column = column.unique()
     # need to get all other parameters from the same group
     if df_special is not None:
         groups = df_special.loc[df_special["parameter"].isin(column), "groupid"]
-        column = df_special.loc[df_special["groupid"].isin(groups), "parameter"]
-    for counter, row in enumerate(column, 1):
-        params = params + "'" + row + "',"
-        if (column.size > 1000) and (counter % 1000 == 0):
-            params = params[:-1]
-            list1000.append(params)
-            params = ""
-    params = params[:-1]
-    list1000.append(params)
-    if list1000[0] == "":
-        return None
-    return list1000
-
-def create_sql_list(keyword, prefix, values):
-    """
-    Due to Oracle 1000 elemets list limitation,
-    any sql list must be divided into smaller pieces
-    """
-    txt = ""
-    for value in values:
-        txt = txt + f"{prefix} in ({value}) or "
-    return keyword + " (" + txt[:-4] + ")\n"
+        column = df_special.loc[df_special["groupid"].isin(groups), "parameter"].unique()
+    values = [str(value) for value in column]
+    return values or None
 
-def trim_all_columns(dataframe):
+def trim_all_columns(dataframe, columns=None):
     """
-    Trim whitespace from ends of each value across all series in dataframe
+    Trim whitespace from ends of each value across all series in dataframe.
+    Only text columns are touched, columns limits it further. Frames
+    marked as trimmed are returned as they are, the result is marked.
     """
-    def trim(value):
-        return value.strip() if isinstance(value, str) else value
-    return dataframe.applymap(trim)
+    if dataframe.attrs.get("trimmed"):
+        return dataframe
+    dataframe = dataframe.copy()
+    for column in columns if columns is not None else dataframe.columns:
+        if dataframe[column].dtype != object:
+            continue
+        try:
+            stripped = dataframe[column].str.strip()
+        except AttributeError:  # no text in this column
+            continue
+        # non text values come back as NaN, keep the original ones
+        dataframe[column] = stripped.where(stripped.notna(), dataframe[column])
+    dataframe.attrs["trimmed"] = True
+    return dataframe
 
 def get_newest_inputdate(dataframe):
     """Finds the newest date parameter index was created"""
@@ -3,237 +3,370 @@
 
 # %%
 # Imports
+import argparse
 import os
 import datetime
 from distutils.util import strtobool
 from timeit import default_timer as timer
 import pandas as pd
+from aggregate_state import AggregateState
+from checkpoint import Checkpoint
 from database import DataBase as db
 from ranges import Ranges
 from db_excel_upload import excel_upload
-from helpers import format_params_list, get_newest_inputdate
+from helpers import params_list
+from metrics import Metrics
+from order_cache import OrderCache
+from pidata_mirror import PidataMirror
+from run_lock import RunLock
+from schema import Schema
 from xfp import Xfp as xfp
 
 # %%
 # initialization
 REDO_EVERYTHING = bool(strtobool(os.environ['REDO_EVERYTHING']))
 USE_ARCH_DB = bool(strtobool(os.environ['USE_ARCH_DB']))
+BULK_WRITE = bool(strtobool(os.environ.get('BULK_WRITE', 'False')))
+# full extraction split by "inputdate" or "mancode", empty for one query
+PARTITION_BY = os.environ.get('PARTITION_BY', '')
+PARTITIONS = int(os.environ.get('PARTITIONS', '16'))
+PARTITION_WORKERS = int(os.environ.get('PARTITION_WORKERS', '4'))
+# stage checkpoints per run, partitions of a full extraction in a subfolder
+CHECKPOINT_PATH = os.environ.get('CHECKPOINT_PATH', 'checkpoints')
+PARTITION_PATH = os.path.join(CHECKPOINT_PATH, "partitions")
+# finished runs kept for --from-stage
+CHECKPOINT_KEEP = int(os.environ.get('CHECKPOINT_KEEP', '3'))
 pd.options.display.max_columns = None
-start1 = timer()
-LAST_EXTRACTION = db.get_key_value("last_XFP_extraction")
-#__LAST_EXTRACTION = "2019-07-04 09:00:00"
-param_list = ""
-wo_list = ""
 
-# %%
-# Redo?
-if REDO_EVERYTHING:
-    USE_ARCH_DB = True
-    LAST_EXTRACTION = None
-    db.truncate_tables(True, False)
-    excel_upload()
 
 # %%
-# get list of all parameters to be extracted from XFP formated for SQL
-df_param_list_main = db.get_param_list_main()
-df_param_list_special = db.get_param_list_special()
-df_param_list_column = pd.concat([df_param_list_main["parameter"],
-                                  df_param_list_special["parameter"]],
-                                 ignore_index=True, sort=False
-                                 ).drop_duplicates().reset_index(drop=True)
-param_list = format_params_list(df_param_list_column)
-del df_param_list_column
+# Stages, each gets the run settings and the frames of the stages before
+# and returns the frames it makes, saved as its checkpoint
+def prepare(info, data):
+    """Reload the parameter lists on a full run and read them"""
+    if info["redo"]:
+        db.truncate_tables(True, False)
+        excel_upload()
+    elif "param_list_main" in data:
+        # lists kept warm by the daemon
+        return {"param_list_main": data["param_list_main"],
+                "param_list_special": data["param_list_special"]}
+    return {"param_list_main": Schema.apply(db.get_param_list_main()),
+            "param_list_special": Schema.apply(db.get_param_list_special())}
 
-# %%
-# Get current UTC time (same as XFP database)
-EXTRACTION_TIME = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-# %%
-# Extract all parameters
-start = timer()
-df_params = xfp.get_parameters(redo=REDO_EVERYTHING, time=LAST_EXTRACTION, params=param_list)
+def parameters(info, data):
+    """Extract new parameters, split into main and special ones"""
+    df_param_list_main = data["param_list_main"]
+    df_param_list_special = data["param_list_special"]
 
-# %%
-# Prep parameters dataframes
-# Filter to include only required parameters
-df_param_main_values = df_params.loc[df_params["PARAMETERCODE"].isin(
-    df_param_list_main["parameter"])]
-df_param_special = df_params.loc[df_params["PARAMETERCODE"].isin(
-    df_param_list_special["parameter"])]
-del df_params
+    def extract(name, params, latest=None):
+        if info["redo"] and PARTITION_BY and not PidataMirror.enabled():
+            return xfp.get_parameters_partitioned(params, PARTITION_BY, PARTITIONS,
+                                                  PARTITION_WORKERS,
+                                                  os.path.join(PARTITION_PATH, name), latest)
+        return xfp.get_parameters(redo=info["redo"], time=info["last_extraction"],
+                                  params=params, latest=latest)
 
+    start = timer()
+    Metrics.start("parameter_extraction")
+    if PidataMirror.sync_enabled():
+        xfp.sync_mirror()
+    if xfp.latest_enabled():
+        # only the latest inputs come from XFP, main and special ones per different keys
+        df_param_main_values = extract("main", params_list(df_param_list_main["parameter"]),
+                                       xfp.LATEST_MAIN)
+        df_param_special = extract("special", params_list(df_param_list_special["parameter"]),
+                                   xfp.LATEST_SPECIAL)
+    else:
+        # get list of all parameters to be extracted from XFP
+        param_list = params_list(pd.concat([df_param_list_main["parameter"],
+                                            df_param_list_special["parameter"]],
+                                           ignore_index=True, sort=False))
+        df_params = extract("all", param_list)
+        # Filter to include only required parameters
+        df_param_main_values = df_params.loc[df_params["PARAMETERCODE"].isin(
+            df_param_list_main["parameter"])]
+        df_param_special = df_params.loc[df_params["PARAMETERCODE"].isin(
+            df_param_list_special["parameter"])]
+        del df_params
 
-# %%
-# Get process orders
-df_orders = xfp.get_orders(USE_ARCH_DB)
+    # Groups without a running aggregate get all their parameters once
+    if (not info["redo"]) and (not df_param_special.empty):
+        members, _ = AggregateState.load()
+        known = AggregateState.known(members, df_param_special["MANCODE"].unique())
+        df_groups = df_param_special.loc[:, ["MANCODE", "PARAMETERCODE"]].merge(
+            df_param_list_special.loc[:, ["parameter", "groupid"]],
+            left_on="PARAMETERCODE", right_on="parameter")
+        df_groups = df_groups.loc[[key not in known for key in
+                                   zip(df_groups["MANCODE"], df_groups["groupid"])]]
+        if not df_groups.empty:
+            wo_list = params_list(df_groups["MANCODE"])
+            param_list = params_list(df_groups["PARAMETERCODE"], df_param_list_special)
+            df_param_special = Schema.concat([df_param_special, xfp.get_parameters(
+                redo=info["use_arch_db"], params=param_list, orders=wo_list,
+                latest=xfp.LATEST_SPECIAL)],
+                                             ignore_index=True, sort=False).drop_duplicates()
+            print(f"Got all parameters of {df_groups['groupid'].nunique()} "
+                  f"special groups without a running aggregate")
+    Metrics.stop("parameter_extraction",
+                 rows_out=df_param_main_values.shape[0] + df_param_special.shape[0])
+    print("Parameters extraction duration= " + str((timer() - start) / 60) + " min")
+    return {"params_main": df_param_main_values, "params_special": df_param_special}
 
-# %%
-# Format wo list
-if not df_param_special.empty:
-    wo_list = format_params_list(df_param_special["MANCODE"])
-# %%
-# Get tasks
-if not df_param_special.empty:
-    df_tasks_a = xfp.get_tasks(wo_list, USE_ARCH_DB)
-    # for self merging later to get the parrent emi
-    df_tasks_b = df_tasks_a
 
-# %%
-# Get all special parameters to recalculate agg functions
-if (not REDO_EVERYTHING) and (not df_param_special.empty):
-    param_list = format_params_list(df_param_special["PARAMETERCODE"], df_param_list_special)
-    df_param_special = xfp.get_parameters(redo=REDO_EVERYTHING, time=LAST_EXTRACTION,
-                                          params=param_list, orders=wo_list)
+def orders(info, data):
+    """Process orders of the parameters, new orders are added to the local cache"""
+    batch_mancodes = pd.concat([data["params_main"]["MANCODE"],
+                                data["params_special"]["MANCODE"]])
+    Metrics.start("order_fetch", rows_in=batch_mancodes.nunique())
+    df_orders, info["order_extraction_time"] = OrderCache.get_orders(
+        batch_mancodes, info["use_arch_db"], redo=info["redo"])
+    Metrics.stop("order_fetch", rows_out=df_orders.shape[0])
+    return {"orders": df_orders}
 
-# %%
-# Extraction duration
-end = timer()
-print("Parameters extraction duration= " + str((end - start) / 60) + " min")
 
-# %%
-# Self join tasks to get parent EMI
-if not df_param_special.empty:
-    df_tasks_self = pd.merge(df_tasks_a, df_tasks_b,
-                             left_on=["MANCODE", "MANINDEX", "BATCHID"],
-                             right_on=["MANCODE", "MANINDEX", "TASKID"])
-    df_tasks_self.rename(columns={"PFCCODE_x": "SUBEMI", "PFCCODE_y": "PARENTEMI",
-                                  "TITLE_y": "SUBEMI_TITLE"}, inplace=True)
-    # cleanup
-    del df_tasks_a, df_tasks_b
+def tasks(info, data):
+    """EMI tasks of the special parameters"""
+    df_param_special = data["params_special"]
+    if df_param_special.empty:
+        return {"tasks": pd.DataFrame()}
+    wo_list = params_list(df_param_special["MANCODE"])
+    Metrics.start("task_fetch", rows_in=len(wo_list))
+    df_tasks = xfp.get_tasks(wo_list, info["use_arch_db"])
+    Metrics.stop("task_fetch", rows_out=df_tasks.shape[0])
+    return {"tasks": df_tasks}
 
-# %%
-# Merge special with tasks to filter based on the task name
-if not df_param_special.empty:
-    df_param_special = pd.merge(df_tasks_self, df_param_special,
-                                left_on=["MANCODE", "ELEMENTID_x", "BATCHID_x", "TASKID_y"],
-                                right_on=["MANCODE", "OPERATIONNUMBER", "BATCHID", "BATCHID"])
-
-    # cleanup
-    del df_tasks_self
-    df_param_special.drop(["MANINDEX", "TASKID_x", "BATCHID_x",
-                           "ELEMENTID_x", "TITLE_x", "TASKID_y",
-                           "BATCHID_y", "ELEMENTID_y", "PICODE",
-                           "NUMVALUE", "DATEVALUE", "TEXTVALUE"],
-                          axis=1, inplace=True)
 
-# %%
-# Merge special with orders to get the master emi
-if not df_param_special.empty:
-    df_param_special = pd.merge(df_param_special, df_orders,
-                                left_on="MANCODE", right_on="PO")
-    df_param_special = pd.merge(df_param_special, df_param_list_special,
-                                left_on=["EMI_MASTER", "PARENTEMI",
-                                         "SUBEMI", "PARAMETERCODE"],
-                                right_on=["emi_master", "emi_parent",
-                                          "emi_sub", "parameter"])
-    df_param_special.drop(["PO", "emi_master", "emi_parent",
-                           "emi_sub", "parameter", "subemi_name"],
-                          axis=1, inplace=True)
-    del df_param_list_special
+def merge(info, data):
+    """
+    Special parameters get their sub and parent EMI from the tasks and the
+    master EMI from the orders, main parameters the master EMI and family.
+    Only the latest input of every parameter is kept.
+    """
+    df_param_special = data["params_special"]
+    df_orders = data["orders"]
+    df_param_list_special = data["param_list_special"]
 
-# %%
-# Filter out indexes smaller than max input index
-if not df_param_special.empty:
-    df_param_special = df_param_special.loc[df_param_special.groupby(
-        ["MANCODE", "EMI_MASTER", "PARENTEMI", "SUBEMI",
-         "BATCHID", "PARAMETERCODE", "description"])["INPUTINDEX"].idxmax()]
+    if not df_param_special.empty:
+        Metrics.start("special_merge", rows_in=df_param_special.shape[0])
+        # Self join tasks to get parent EMI
+        df_tasks_self = pd.merge(data["tasks"], data["tasks"],
+                                 left_on=["MANCODE", "MANINDEX", "BATCHID"],
+                                 right_on=["MANCODE", "MANINDEX", "TASKID"])
+        df_tasks_self.rename(columns={"PFCCODE_x": "SUBEMI", "PFCCODE_y": "PARENTEMI",
+                                      "TITLE_y": "SUBEMI_TITLE"}, inplace=True)
 
-# %%
-# Get ranges for special parameters
-if not df_param_special.empty:
-    df_param_special = Ranges.add_ranges(df_param_special, USE_ARCH_DB)
+        # Merge special with tasks to filter based on the task name
+        df_param_special = pd.merge(df_tasks_self, df_param_special,
+                                    left_on=["MANCODE", "ELEMENTID_x", "BATCHID_x", "TASKID_y"],
+                                    right_on=["MANCODE", "OPERATIONNUMBER", "BATCHID", "BATCHID"])
+        del df_tasks_self
+        df_param_special.drop(["MANINDEX", "TASKID_x", "BATCHID_x",
+                               "ELEMENTID_x", "TITLE_x", "TASKID_y",
+                               "BATCHID_y", "ELEMENTID_y", "PICODE",
+                               "NUMVALUE", "DATEVALUE", "TEXTVALUE"],
+                              axis=1, inplace=True, errors="ignore")
 
-# %%
-# Calculate agg values
-if not df_param_special.empty:
-    df_param_special["VALUE"] = pd.to_numeric(
-        df_param_special["VALUE"], errors='coerce')
-    grouped = df_param_special.groupby(["MANCODE", "family", "area", "description",
-                                        "agg_function", "dataformat", "groupid"])
-    df_param_special = grouped.agg({'VALUE': ['min', 'max', 'mean'],
-                                    "INPUTDATE": 'max', 'value_min': 'max', "value_max": 'max',
-                                    "tolerance_min": 'max',
-                                    "tolerance_max": 'max'}).reset_index()
-    del grouped # not needed anymore
-    df_param_special.columns = ["MANCODE", "family", "area", "description",
-                                "agg_function", "dataformat", "groupid",
-                                "MIN", "MAX", "AVG", "INPUTDATE",
-                                "value_min", "value_max", "tolerance_min", "tolerance_max"]
-    # select the actual VALUE
-    df_param_special["VALUE"] = df_param_special["MIN"]
-    df_param_special.loc[df_param_special["agg_function"] == "MAX", "VALUE"] = \
-        df_param_special["MAX"]
-    df_param_special.loc[df_param_special["agg_function"] == "AVG", "VALUE"] = \
-        df_param_special["AVG"]
-    df_param_special["VALUE"] = df_param_special["VALUE"].round(2)
+        # Merge special with orders to get the master emi
+        df_param_special = pd.merge(df_param_special, df_orders,
+                                    left_on="MANCODE", right_on="PO")
+        df_param_special = pd.merge(df_param_special, df_param_list_special,
+                                    left_on=["EMI_MASTER", "PARENTEMI",
+                                             "SUBEMI", "PARAMETERCODE"],
+                                    right_on=["emi_master", "emi_parent",
+                                              "emi_sub", "parameter"])
+        df_param_special.drop(["PO", "emi_master", "emi_parent",
+                               "emi_sub", "parameter", "subemi_name"],
+                              axis=1, inplace=True)
 
+        # Filter out indexes smaller than max input index
+        if not df_param_special.empty:
+            df_param_special = df_param_special.loc[df_param_special.groupby(
+                ["MANCODE", "EMI_MASTER", "PARENTEMI", "SUBEMI",
+                 "BATCHID", "PARAMETERCODE", "description"], observed=True)["INPUTINDEX"]
+                .idxmax()]
+        Metrics.stop("special_merge", rows_out=df_param_special.shape[0])
 
-# %%
-# Join with the po table,
-# mainly to get the master emi to join the param csv file later
-df_param_main_values = pd.merge(df_param_main_values,
-                                df_orders,
-                                left_on="MANCODE", right_on="PO")
+    # Join with the po table,
+    # mainly to get the master emi to join the param csv file later
+    df_param_main_values = data["params_main"]
+    Metrics.start("main_merge", rows_in=df_param_main_values.shape[0])
+    df_param_main_values = pd.merge(df_param_main_values,
+                                    df_orders,
+                                    left_on="MANCODE", right_on="PO")
 
-# %%
-# Join with parameter list to get family name, needed for saving separate files
-df_param_main_values = pd.merge(df_param_main_values,
-                                df_param_list_main,
-                                left_on=["PARAMETERCODE", "EMI_MASTER"],
-                                right_on=["parameter", "emi_master"])
-del df_param_list_main
+    # Join with parameter list to get family name, needed for saving separate files
+    df_param_main_values = pd.merge(df_param_main_values,
+                                    data["param_list_main"],
+                                    left_on=["PARAMETERCODE", "EMI_MASTER"],
+                                    right_on=["parameter", "emi_master"])
 
-# %%
-# Filter out indexes smaller than max input index
-# First sort to take highest INPUTDATE and if the same then the INPUTINDEX
-df_param_main_values.sort_values(
-    ["MANCODE", "EMI_MASTER", "PARAMETERCODE", "INPUTDATE", "INPUTINDEX"], ascending=False, inplace=True)
-# INPUTDATE as not grouping by batchid
-df_param_main_values = df_param_main_values.loc[
-    df_param_main_values.groupby(["MANCODE", "EMI_MASTER", "PARAMETERCODE"])["INPUTDATE"].idxmax()]
+    # Filter out indexes smaller than max input index
+    # First sort to take highest INPUTDATE and if the same then the INPUTINDEX
+    df_param_main_values.sort_values(
+        ["MANCODE", "EMI_MASTER", "PARAMETERCODE", "INPUTDATE", "INPUTINDEX"],
+        ascending=False, inplace=True)
+    # INPUTDATE as not grouping by batchid
+    df_param_main_values = df_param_main_values.loc[
+        df_param_main_values.groupby(["MANCODE", "EMI_MASTER", "PARAMETERCODE"],
+                                     observed=True)["INPUTDATE"].idxmax()]
+    Metrics.stop("main_merge", rows_out=df_param_main_values.shape[0])
+    return {"params_main": df_param_main_values, "params_special": df_param_special}
 
-# %%
-# Get ranges for normal parameters
-df_param_main_values = Ranges.add_ranges(df_param_main_values, USE_ARCH_DB)
 
-# %%
-# Save normal parameters to the database
-if REDO_EVERYTHING:
-    db.truncate_tables(False, True)
-#df_orders.to_pickle("C:\\IT\\pickles\\df_orders.pkl")
-#df_param_main_values.to_pickle("C:\\IT\\pickles\\df_param_main_values.pkl")
-db.update_params_values(df_param_main_values)
-db.update_process_orders(df_orders)
+def ranges(info, data):
+    """Get ranges for special and normal parameters"""
+    df_param_special = data["params_special"]
+    if not df_param_special.empty:
+        Metrics.start("range_extraction", rows_in=df_param_special.shape[0])
+        df_param_special = Ranges.add_ranges(df_param_special, info["use_arch_db"])
+        Metrics.stop("range_extraction", rows_out=df_param_special.shape[0])
 
-# %%
-# Save special parameters to the database
-if not df_param_special.empty:
-    df_param_special = df_param_special.replace({pd.np.nan: None})
-    db.update_params_values(df_param_special)
+    df_param_main_values = data["params_main"]
+    Metrics.start("range_extraction", rows_in=df_param_main_values.shape[0])
+    df_param_main_values = Ranges.add_ranges(df_param_main_values, info["use_arch_db"])
+    Metrics.stop("range_extraction", rows_out=df_param_main_values.shape[0])
+    return {"params_main": df_param_main_values, "params_special": df_param_special}
+
+
+def aggregation(info, data):
+    """Update the running agg values of the special parameter groups"""
+    df_param_special = data["params_special"]
+    if df_param_special.empty:
+        return {"params_special": df_param_special}
+    Metrics.start("aggregation", rows_in=df_param_special.shape[0])
+    # a full run starts the running aggregates again
+    members, groups = (None, None) if info["redo"] else AggregateState.load()
+    df_param_special, members, groups = AggregateState.update(df_param_special,
+                                                              members, groups)
+    Metrics.stop("aggregation", rows_out=df_param_special.shape[0])
+    return {"params_special": df_param_special,
+            "special_members": members, "special_groups": groups}
+
+
+def write(info, data):
+    """Save parameters and their orders to the database, then the extraction time"""
+    df_param_main_values = Schema.plain(data["params_main"])
+    df_param_special = Schema.plain(data["params_special"])
+    df_orders = Schema.plain(data["orders"])
+
+    Metrics.start("db_writes", rows_in=df_param_main_values.shape[0] + df_param_special.shape[0])
+    if info["redo"]:
+        db.truncate_tables(False, True)
+    db.update_params_values(df_param_main_values, bulk=BULK_WRITE)
     db.update_process_orders(
-        df_orders.loc[df_orders["PO"].isin(df_param_special["MANCODE"])])
+        df_orders.loc[df_orders["PO"].isin(df_param_main_values["MANCODE"])], bulk=BULK_WRITE)
+
+    if not df_param_special.empty:
+        df_param_special = df_param_special.replace({pd.np.nan: None})
+        db.update_params_values(df_param_special, bulk=BULK_WRITE)
+        db.update_process_orders(
+            df_orders.loc[df_orders["PO"].isin(df_param_special["MANCODE"])], bulk=BULK_WRITE)
+    Metrics.stop("db_writes", rows_out=df_param_main_values.shape[0] + df_param_special.shape[0]
+                 - db.skipped_rows().get("params_values", 0))
+
+    if "special_members" in data:
+        AggregateState.save(data["special_members"], data["special_groups"])
+
+    # save last extraction date
+    db.save_key_value("last_XFP_extraction", info["extraction_time"])
+    OrderCache.save_watermark(info["order_extraction_time"])
+    if info["redo"]:
+        db.save_key_value("last_XFP_full_extraction", info["extraction_time"])
+        xfp.clear_checkpoints(PARTITION_PATH)
+    return {}
+
+
+STAGES = [("prepare", prepare), ("parameters", parameters), ("orders", orders),
+          ("tasks", tasks), ("merge", merge), ("ranges", ranges),
+          ("aggregation", aggregation), ("write", write)]
 
-# %%
-# save last extraction date
-db.save_key_value("last_XFP_extraction", EXTRACTION_TIME)
-if REDO_EVERYTHING:
-    db.save_key_value("last_XFP_full_extraction", EXTRACTION_TIME)
 
 # %%
-# Summary
-currentDT = datetime.datetime.now()
-print(f"There are {df_param_main_values.shape[0]} new normal records.")
-print(f"There are {df_param_special.shape[0]} new special records.")
-end1 = timer()
-print(f"Total execution time = {str(round(((end1 - start1) / 60), 2))} min")
-with open("log.txt", "a+") as text_file:
-    print(
-        currentDT.strftime("%Y-%m-%d %H:%M:%S") +
-        f" - {df_param_main_values.shape[0]} new normal records, " +
-        f"{df_param_special.shape[0]} new special records. Total time: " +
-        f"{str(round(((end1 - start1) / 60), 2))} min", \
-        file=text_file)
-
-#%%
+def run(resume=False, from_stage=None, run_id=None, redo=None, catalog=None):
+    """
+    Run the stages, a new run by default. resume carries on the latest
+    (or run_id) run at its first unfinished stage, from_stage reruns that
+    stage and the ones after it with the frames saved before.
+    redo overrides REDO_EVERYTHING, catalog gives the parameter lists.
+    Returns the run frames.
+    """
+    start1 = timer()
+    Metrics.reset()
+    db.reset_skipped_rows()
+    Schema.reset()
+    redo = REDO_EVERYTHING if redo is None else redo
+    checkpoint = None
+    if resume or from_stage:
+        checkpoint = Checkpoint.open(CHECKPOINT_PATH, run_id)
+        if checkpoint is None:
+            print("No run to resume, starting a new one")
+    if checkpoint is None:
+        checkpoint = Checkpoint.new(CHECKPOINT_PATH, {
+            "redo": redo,
+            "use_arch_db": USE_ARCH_DB or redo,
+            "last_extraction": None if redo else db.get_key_value("last_XFP_extraction"),
+            # Get current UTC time (same as XFP database)
+            "extraction_time": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")})
+    names = [name for name, _ in STAGES]
+    if from_stage:
+        checkpoint.reset(names[names.index(from_stage):])
+    print(f"Run {checkpoint.run_id}: {checkpoint.info}")
 
+    # frames left by the finished stages, the last stage making a frame wins
+    data = dict(catalog or {})
+    for name in reversed(names):
+        if checkpoint.done(name):
+            data.update(checkpoint.load(name, exclude=data))
+            print(f"Stage {name} loaded from the checkpoint")
 
+    for name, stage in STAGES:
+        if checkpoint.done(name):
+            continue
+        print(f"Stage {name}")
+        # frames of earlier stages or checkpoints get the categories of this run
+        data = {key: Schema.apply(frame) for key, frame in data.items()}
+        frames = stage(checkpoint.info, data)
+        checkpoint.save(name, frames)
+        data.update(frames)
+
+    # Summary
+    df_param_main_values = data["params_main"]
+    df_param_special = data["params_special"]
+    SKIPPED = db.skipped_rows()
+    currentDT = datetime.datetime.now()
+    print(f"There are {df_param_main_values.shape[0]} new normal records.")
+    print(f"There are {df_param_special.shape[0]} new special records.")
+    print(f"Unchanged rows skipped: {SKIPPED}")
+    end1 = timer()
+    print(f"Total execution time = {str(round(((end1 - start1) / 60), 2))} min")
+    print(f"Connection pools: {db.pool_stats()}")
+    Metrics.write(run_id=checkpoint.run_id,
+                  normal_records=df_param_main_values.shape[0],
+                  special_records=df_param_special.shape[0],
+                  skipped_rows=SKIPPED, pools=db.pool_stats())
+    with open("log.txt", "a+") as text_file:
+        print(
+            currentDT.strftime("%Y-%m-%d %H:%M:%S") +
+            f" - {df_param_main_values.shape[0]} new normal records, " +
+            f"{df_param_special.shape[0]} new special records, " +
+            f"{sum(SKIPPED.values())} unchanged rows skipped. Total time: " +
+            f"{str(round(((end1 - start1) / 60), 2))} min", \
+            file=text_file)
+    Checkpoint.prune(CHECKPOINT_PATH, CHECKPOINT_KEEP)
+    return data
+
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract XFP parameters to the cpv database")
+    parser.add_argument("--resume", action="store_true",
+                        help="carry on the latest run at its first unfinished stage")
+    parser.add_argument("--from-stage", choices=[name for name, _ in STAGES],
+                        help="rerun this stage and the ones after it")
+    parser.add_argument("--run-id", help="run to resume, the latest one by default")
+    # known args only, interactive kernels pass their own
+    args = parser.parse_known_args()[0]
+    with RunLock():
+        run(args.resume, args.from_stage, args.run_id)
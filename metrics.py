@@ -0,0 +1,176 @@
+"""Per stage metrics of a pipeline run"""
+# %%
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from timeit import default_timer as timer
+from database import DataBase as db
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # optional, /proc is read instead on Linux
+    psutil = None
+
+
+# %%
+class Metrics:
+    """
+    Wall time, rows in and out, peak RSS and bytes fetched from XFP per stage.
+    A stage runs from start(name) to stop(name), a stage started again adds
+    to its totals. The peak RSS of a stage is the highest resident memory
+    sampled every RSS_SAMPLE_INTERVAL seconds while it runs, not the peak of
+    the process, so a stage after a bigger one still shows its own.
+    write() saves the run to METRICS_PATH as metrics.json
+    and as cpv.prom for the Prometheus node exporter textfile collector.
+    """
+    __PATH = os.environ.get('METRICS_PATH', 'metrics')
+    __SAMPLE_INTERVAL = float(os.environ.get('RSS_SAMPLE_INTERVAL', '0.05'))
+    __LOCK = threading.Lock()
+    __sampler = None
+    __run_start = timer()
+    __run_peak = None
+    __stages = {}
+    __running = {}
+
+    @classmethod
+    def reset(cls):
+        """Start a new run, stages of the previous one are dropped"""
+        with cls.__LOCK:
+            cls.__run_start = timer()
+            cls.__run_peak = None
+            cls.__stages = {}
+            cls.__running = {}
+
+    @staticmethod
+    def peak_rss():
+        """Peak resident memory of the process in bytes, None when unknown"""
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == "darwin" else peak * 1024
+
+    @staticmethod
+    def current_rss():
+        """Resident memory of the process now in bytes, None when unknown"""
+        if psutil is not None:
+            return psutil.Process().memory_info().rss
+        try:
+            with open("/proc/self/statm") as file:
+                return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    @classmethod
+    def start(cls, name, rows_in=None):
+        """Start timing a stage"""
+        with cls.__LOCK:
+            cls.__running[name] = (timer(), db.xfp_fetched()["bytes"])
+            record = cls.__stages.setdefault(name, {"stage": name, "seconds": 0.0,
+                                                    "rows_in": None, "rows_out": None,
+                                                    "peak_rss_bytes": None,
+                                                    "bytes_fetched": 0})
+            if rows_in is not None:
+                record["rows_in"] = (record["rows_in"] or 0) + int(rows_in)
+            if cls.__sampler is None:
+                cls.__sampler = threading.Thread(target=cls.__sampling, daemon=True)
+                cls.__sampler.start()
+        cls.__sample()
+
+    @classmethod
+    def stop(cls, name, rows_out=None):
+        """Stop timing a stage and print it"""
+        cls.__sample()
+        with cls.__LOCK:
+            start, fetched = cls.__running.pop(name)
+        record = cls.__stages[name]
+        record["seconds"] = round(record["seconds"] + timer() - start, 3)
+        record["bytes_fetched"] += db.xfp_fetched()["bytes"] - fetched
+        if rows_out is not None:
+            record["rows_out"] = (record["rows_out"] or 0) + int(rows_out)
+        print(f"{name}: {record['seconds']} s, rows in {record['rows_in']}, "
+              f"out {record['rows_out']}, fetched {record['bytes_fetched']} bytes")
+
+    @classmethod
+    def __sample(cls):
+        """Raise the peaks of the running stages and of the run to the RSS now"""
+        rss = cls.current_rss()
+        if rss is None:
+            return
+        with cls.__LOCK:
+            cls.__run_peak = max(cls.__run_peak or 0, rss)
+            for name in cls.__running:
+                record = cls.__stages[name]
+                record["peak_rss_bytes"] = max(record["peak_rss_bytes"] or 0, rss)
+
+    @classmethod
+    def __sampling(cls):
+        """Sampler thread, runs while a stage is running"""
+        while True:
+            with cls.__LOCK:
+                if not cls.__running:
+                    cls.__sampler = None
+                    return
+            cls.__sample()
+            time.sleep(cls.__SAMPLE_INTERVAL)
+
+    @classmethod
+    def stages(cls):
+        """Stage records in the order they were started"""
+        return [dict(record) for record in cls.__stages.values()]
+
+    @classmethod
+    def write(cls, **run):
+        """Save the stages and the run values given, e.g. skipped rows"""
+        os.makedirs(cls.__PATH, exist_ok=True)
+        report = {"finished": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                  "seconds": round(timer() - cls.__run_start, 3),
+                  # sampled during the stages, the process peak may be from an earlier run
+                  "peak_rss_bytes": cls.__run_peak,
+                  "process_peak_rss_bytes": cls.peak_rss(),
+                  "xfp_fetched": db.xfp_fetched(),
+                  **run,
+                  "stages": cls.stages()}
+        cls.__replace("metrics.json", json.dumps(report, indent=2, default=str))
+        cls.__replace("cpv.prom", cls.prometheus(report))
+        return report
+
+    @staticmethod
+    def prometheus(report):
+        """Report in the Prometheus text exposition format"""
+        lines = []
+        gauges = [("cpv_stage_seconds", "seconds", "Wall time of the stage"),
+                  ("cpv_stage_rows_in", "rows_in", "Rows going into the stage"),
+                  ("cpv_stage_rows_out", "rows_out", "Rows coming out of the stage"),
+                  ("cpv_stage_peak_rss_bytes", "peak_rss_bytes",
+                   "Peak resident memory sampled during the stage"),
+                  ("cpv_stage_bytes_fetched", "bytes_fetched",
+                   "Bytes fetched from XFP during the stage")]
+        for metric, key, description in gauges:
+            lines += [f"# HELP {metric} {description}", f"# TYPE {metric} gauge"]
+            lines += [f'{metric}{{stage="{stage["stage"]}"}} {stage[key]}'
+                      for stage in report["stages"] if stage[key] is not None]
+        lines += ["# HELP cpv_run_seconds Wall time of the run",
+                  "# TYPE cpv_run_seconds gauge",
+                  f"cpv_run_seconds {report['seconds']}",
+                  "# HELP cpv_run_finished_timestamp_seconds End of the run",
+                  "# TYPE cpv_run_finished_timestamp_seconds gauge",
+                  f"cpv_run_finished_timestamp_seconds "
+                  f"{int(datetime.datetime.now().timestamp())}"]
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def __replace(cls, name, content):
+        """Write the file in one step, collectors never read half a file"""
+        path = os.path.join(cls.__PATH, name)
+        with open(path + ".tmp", "w") as file:
+            file.write(content)
+        os.replace(path + ".tmp", path)
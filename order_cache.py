@@ -0,0 +1,69 @@
+"""Local cache of the process orders extracted from XFP"""
+# %%
+import datetime
+import os
+import pandas as pd
+from database import DataBase as db
+from schema import Schema
+from xfp import Xfp as xfp
+
+
+# %%
+class OrderCache:
+    """
+    Process orders known from earlier runs, kept in a pickle (ORDER_CACHE_PATH).
+    Each run fetches the orders created since the watermark saved in
+    key_values as last_order_extraction, plus every order of the parameter
+    batch by key, cached or not, as XFP can change an order after it was
+    created. The cache only serves the orders outside the batch.
+    Without a cache or watermark all orders are fetched again.
+    """
+    __PATH = os.environ.get('ORDER_CACHE_PATH', 'order_cache.pkl')
+    __WATERMARK = "last_order_extraction"
+
+    @classmethod
+    def get_orders(cls, mancodes, arch_db, redo=False):
+        """
+        Orders of the given process orders, the cache is refreshed first.
+        Returns the orders and the extraction time to save with save_watermark.
+        """
+        # UTC like the XFP database, taken before the query
+        extraction_time = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        mancodes = pd.Series(mancodes, dtype=object).dropna().unique()
+        df_cached = None if redo else cls.__load()
+        watermark = None if df_cached is None else db.get_key_value(cls.__WATERMARK)
+
+        if watermark is None:
+            print("Getting all process orders")
+            df_orders = xfp.get_orders(arch_db)
+        else:
+            df_new = xfp.get_orders(arch_db, since=watermark, orders=sorted(mancodes))
+            print(f"Got {df_new.shape[0]} new or batch process orders, "
+                  f"{df_cached.shape[0]} cached")
+            # a batch order XFP no longer returns is not kept from the cache
+            df_cached = df_cached.loc[~df_cached["PO"].isin(mancodes)]
+            df_orders = Schema.concat([df_cached, df_new], ignore_index=True, sort=False) \
+                .drop_duplicates(subset="PO", keep="last").reset_index(drop=True)
+        cls.__save(df_orders)
+
+        df_orders = df_orders.loc[df_orders["PO"].isin(mancodes)].reset_index(drop=True)
+        df_orders.attrs["trimmed"] = True
+        return df_orders, extraction_time
+
+    @classmethod
+    def save_watermark(cls, extraction_time):
+        """Orders up to extraction_time are cached, call once the run succeeded"""
+        db.save_key_value(cls.__WATERMARK, extraction_time)
+
+    @classmethod
+    def __load(cls):
+        """Cached orders, None when there is no cache"""
+        if not os.path.exists(cls.__PATH):
+            return None
+        return pd.read_pickle(cls.__PATH)
+
+    @classmethod
+    def __save(cls, dataframe):
+        """Write the cache, replacing the file in one step"""
+        dataframe.to_pickle(cls.__PATH + ".tmp")
+        os.replace(cls.__PATH + ".tmp", cls.__PATH)
@@ -0,0 +1,139 @@
+"""Local Parquet mirror of the XFP parameter data"""
+# %%
+import json
+import os
+import uuid
+from distutils.util import strtobool
+import pandas as pd
+import pyarrow as pa
+
+
+# %%
+class PidataMirror:
+    """
+    The e2s_pidata_man columns of Xfp.parameters_sql from both schemas,
+    partitioned by input month as PIDATA_MIRROR/month=yyyy-mm/*.parquet.
+    Xfp.sync_mirror adds the rows entered since the last sync, reads filter
+    on month, inputdate, parameter and order in the Parquet reader.
+    PIDATA_MIRROR_SYNC=False reads the mirror as it is, without XFP.
+    """
+    __PATH = os.environ.get('PIDATA_MIRROR', '')
+    __SYNC = bool(strtobool(os.environ.get('PIDATA_MIRROR_SYNC', 'True')))
+    # a month with more files than this is rewritten as one file after a sync
+    __COMPACT_FILES = int(os.environ.get('PIDATA_MIRROR_COMPACT_FILES', '8'))
+    __COLUMNS = {"PICODE": "int64", "MANCODE": object, "BATCHID": "int64",
+                 "PARAMETERCODE": object, "INPUTINDEX": "int64",
+                 "INPUTDATE": "datetime64[ns]", "OPERATIONNUMBER": "int64",
+                 "TAGNUMBER": "int64", "DATATYPE": "int64", "NUMVALUE": "float64",
+                 "DATEVALUE": object, "TEXTVALUE": object, "BROWSINGINDEX": "int64"}
+    # the same types in every file, columns without any value included
+    __SCHEMA = pa.schema([(column, pa.string() if dtype == object
+                           else pa.timestamp("ns") if dtype.startswith("datetime")
+                           else pa.from_numpy_dtype(dtype))
+                          for column, dtype in __COLUMNS.items()])
+    __touched = set()
+
+    @classmethod
+    def enabled(cls):
+        """True when parameters are read from the mirror"""
+        return bool(cls.__PATH)
+
+    @classmethod
+    def sync_enabled(cls):
+        """True when the mirror is synced before it is read"""
+        return cls.enabled() and cls.__SYNC
+
+    @classmethod
+    def watermark(cls):
+        """Time of the last finished sync, None before the first one"""
+        manifest = os.path.join(cls.__PATH, "_mirror.json")
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest) as file:
+            return json.load(file)["synced"]
+
+    @classmethod
+    def append(cls, dataframe):
+        """Add fetched rows, one new file per input month"""
+        if dataframe.empty:
+            return
+        dataframe = dataframe.loc[:, list(cls.__COLUMNS)]
+        # odd dates like year 0001 do not fit a timestamp, clean_parameters drops them
+        dataframe["DATEVALUE"] = dataframe["DATEVALUE"].map(
+            lambda value: None if value is None or pd.isna(value) else str(value))
+        dataframe["INPUTDATE"] = pd.to_datetime(dataframe["INPUTDATE"])
+        dataframe = dataframe.astype(cls.__COLUMNS)
+        for month, df_month in dataframe.groupby(dataframe["INPUTDATE"].dt.strftime("%Y-%m")):
+            path = os.path.join(cls.__PATH, f"month={month}")
+            os.makedirs(path, exist_ok=True)
+            cls.__write(df_month, os.path.join(path, f"part-{uuid.uuid4().hex}.parquet"))
+            cls.__touched.add(month)
+
+    @classmethod
+    def finish_sync(cls, synced):
+        """Compact the months that got many files and save the sync time"""
+        for month in sorted(cls.__touched):
+            path = os.path.join(cls.__PATH, f"month={month}")
+            files = [os.path.join(path, name) for name in os.listdir(path)
+                     if name.endswith(".parquet")]
+            if len(files) > cls.__COMPACT_FILES:
+                df_month = pd.concat([pd.read_parquet(file) for file in files],
+                                     ignore_index=True, sort=False).drop_duplicates()
+                cls.__write(df_month, os.path.join(path, f"part-{uuid.uuid4().hex}.parquet"))
+                for file in files:
+                    os.remove(file)
+        cls.__touched = set()
+        os.makedirs(cls.__PATH, exist_ok=True)
+        manifest = os.path.join(cls.__PATH, "_mirror.json")
+        with open(manifest + ".tmp", "w") as file:
+            json.dump({"synced": synced}, file)
+        os.replace(manifest + ".tmp", manifest)
+
+    @classmethod
+    def read(cls, time=None, params=None, orders=None, partition=None):
+        """
+        Rows as Xfp.parameters_sql selects them, arguments as there.
+        Only the months and row groups that can match are read.
+        """
+        filters = []
+        null_column = None
+        if time:
+            since = pd.Timestamp(time)
+            filters += [("month", ">=", since.strftime("%Y-%m")),
+                        ("INPUTDATE", ">=", since)]
+        if params:
+            filters.append(("PARAMETERCODE", "in", list(params)))
+        if orders:
+            filters.append(("MANCODE", "in", list(orders)))
+        if partition and partition[1] == "is null":
+            # Xfp.IS_NULL, parquet filters do not select missing values
+            null_column = partition[0].upper()
+        elif partition:
+            column, low, high = partition
+            column = column.upper()
+            if low:
+                low = pd.Timestamp(low) if column == "INPUTDATE" else low
+                filters.append((column, ">=", low))
+            if high:
+                high = pd.Timestamp(high) if column == "INPUTDATE" else high
+                filters.append((column, "<", high))
+
+        if not os.path.isdir(cls.__PATH) or not any(
+                name.startswith("month=") for name in os.listdir(cls.__PATH)):
+            return pd.DataFrame(columns=list(cls.__COLUMNS))
+        dataframe = pd.read_parquet(cls.__PATH, engine="pyarrow", filters=filters or None)
+        if null_column:
+            dataframe = dataframe.loc[dataframe[null_column].isna()]
+        # rows come again when syncs overlap
+        dataframe = dataframe.loc[:, list(cls.__COLUMNS)].drop_duplicates() \
+            .reset_index(drop=True)
+        dataframe.attrs["trimmed"] = True
+        return dataframe
+
+    @staticmethod
+    def __write(dataframe, path):
+        """Write a file in one step, readers skip names starting with _"""
+        temporary = os.path.join(os.path.dirname(path), "_" + os.path.basename(path))
+        dataframe.to_parquet(temporary, engine="pyarrow", index=False,
+                             schema=PidataMirror.__SCHEMA)
+        os.replace(temporary, path)
@@ -3,70 +3,101 @@
 
 # %%
 import datetime
+import os
+from functools import lru_cache
 import pandas as pd
-import numpy as np
-from bs4 import BeautifulSoup
-from helpers import create_sql_snippet, is_string_digit, format_params_list
+from lxml import etree
+from helpers import is_string_digit, params_list
+from spec_cache import SpecCache
 from xfp import Xfp as xfp
 
 
+# %%
+class InputTags:
+    """
+    lxml parser target, collects the range attributes of every <input> tag
+    while the html streams through, without building a document tree
+    """
+
+    def __init__(self):
+        self.tags = {}
+
+    @staticmethod
+    def clean(val):
+        """Strip the brackets, "null" means no value"""
+        if val == "null":
+            return None
+        return val.replace("[", "").replace("]", "")
+
+    def start(self, tag, attrib):
+        """Save (tolmin, tolmax, min, max) under the tag id, first tag wins"""
+        if tag != "input" or "id" not in attrib or attrib["id"] in self.tags:
+            return
+        values = [attrib.get(name) for name in
+                  ["val_tolmin", "val_tolmax", "val_min", "val_max"]]
+        # tag without all range attributes gets no ranges at all
+        if None in values:
+            self.tags[attrib["id"]] = None
+        else:
+            self.tags[attrib["id"]] = tuple(self.clean(val) for val in values)
+
+    def end(self, tag):
+        """Nothing to do on closing tags"""
+
+    def close(self):
+        """Parsing result"""
+        return self.tags
+
+
 # %%
 class Ranges:
     """Extract and add XFP paramaters specs and tolerances"""
+    __HTML_CACHE_SIZE = int(os.environ.get('HTML_CACHE_SIZE', '4096'))
 
     @classmethod
     def params_to_values(cls, df_main, redo):
         """Extracts parameters and saves actual values"""
-
-
-        # get all spec parameters values
-        df_values = pd.concat([
-            df_main.loc[df_main["value_min"].notna(), ["MANCODE",
-                                                    "value_min"]].rename(columns={"value_min": "value"}),
-            df_main.loc[df_main["value_max"].notna(), ["MANCODE",
-                                                    "value_max"]].rename(columns={"value_max": "value"}),
-            df_main.loc[df_main["tolerance_min"].notna(), ["MANCODE",
-                                                        "tolerance_min"]].rename(columns={"tolerance_min": "value"}),
-            df_main.loc[df_main["tolerance_max"].notna(), ["MANCODE",
-                                                        "tolerance_max"]].rename(columns={"tolerance_max": "value"})],
-            sort=False).drop_duplicates()
-
-        # drop all but parameter names
-        df_values.dropna(subset=["value"], inplace=True)
-        df_values = df_values.loc[~df_values["value"].apply(is_string_digit)]
+        range_columns = ["value_min", "value_max", "tolerance_min", "tolerance_max"]
+
+        # one row per range cell referring to a spec parameter
+        df_specs = df_main.loc[:, ["MANCODE", "BATCHID"] + range_columns] \
+            .rename_axis("row").reset_index() \
+            .melt(id_vars=["row", "MANCODE", "BATCHID"], value_vars=range_columns,
+                  var_name="column", value_name="PARAMETERCODE") \
+            .dropna(subset=["PARAMETERCODE"])
+        is_digit = {value: is_string_digit(value)
+                    for value in df_specs["PARAMETERCODE"].unique()}
+        df_specs = df_specs.loc[~df_specs["PARAMETERCODE"].map(is_digit).astype(bool)]
+        if df_specs.empty:
+            return df_main
 
         # query xfp db
-        params = format_params_list(df_values["value"])
-        orders = format_params_list(df_values["MANCODE"])
-        if params and orders:
-            df_values = xfp.get_parameters(redo=redo, params=params, orders=orders)
-        else:
-            return pd.DataFrame() # return empty df
+        params = params_list(df_specs["PARAMETERCODE"])
+        orders = params_list(df_specs["MANCODE"])
+        df_values = xfp.get_parameters(redo=redo, params=params, orders=orders,
+                                       latest=xfp.LATEST_BATCH)
 
         # take only parameters values entered last in the given batchid
-        df_values = df_values.loc[df_values.groupby(
-            ["MANCODE", "BATCHID", "PARAMETERCODE"])["INPUTINDEX"].idxmax()]
-
-        try:
-            # go thrugh each spec parameter and replace it with an actual value
-            for row in df_main.itertuples():
-                for col in ["value_min", "value_max", "tolerance_min", "tolerance_max"]:
-                    spec_param = df_main.at[row.Index, col]
-                    if (spec_param is not None) and (not is_string_digit(spec_param)):
-                        temp = df_values.loc[(
-                            df_values["MANCODE"] == row.MANCODE)]
-                        value = df_values.loc[(df_values["MANCODE"] == row.MANCODE)
-                                            & (df_values["BATCHID"] == row.BATCHID)
-                                            & (df_values["PARAMETERCODE"] == spec_param),
-                                            "VALUE"].iloc[0]
-                        df_main.at[row.Index, col] = value
-        except IndexError as e:
-            print(e)
-            print(row)
-            print("spec_param = " + spec_param)
-            print("col = " + col)
-            print(temp)
-            #raise
+        if not df_values.empty:
+            df_values = df_values.loc[df_values.groupby(
+                ["MANCODE", "BATCHID", "PARAMETERCODE"], observed=True)["INPUTINDEX"].idxmax(),
+                                      ["MANCODE", "BATCHID", "PARAMETERCODE", "VALUE"]]
+        else:
+            df_values = pd.DataFrame(columns=["MANCODE", "BATCHID", "PARAMETERCODE", "VALUE"])
+
+        # replace every spec parameter with its actual value
+        df_specs = df_specs.merge(df_values.astype({"BATCHID": df_specs["BATCHID"].dtype}),
+                                  how="left", on=["MANCODE", "BATCHID", "PARAMETERCODE"])
+        unresolved = df_specs["VALUE"].isna()
+        resolved = df_specs.loc[~unresolved].pivot(index="row", columns="column", values="VALUE")
+        for col, values in resolved.items():
+            values = values.dropna()
+            df_main.loc[values.index, col] = values
+
+        if unresolved.any():
+            print(f"{unresolved.sum()} spec parameters without a value, left unresolved:")
+            print(df_specs.loc[unresolved, ["MANCODE", "BATCHID", "column", "PARAMETERCODE"]]
+                  .to_string(index=False))
         return df_main
 
 
@@ -83,70 +114,86 @@ class Ranges:
         if dataframe.empty:
             return dataframe
 
-        # Have to split dataframe due to oracle query limit
-        split_size = (dataframe.shape[0] // 1000) + 1
-        df_list = np.array_split(dataframe.loc[:, [
-                                 "MANCODE", "BATCHID", "OPERATIONNUMBER", "BROWSINGINDEX"]].drop_duplicates(), split_size)
-        df_html = pd.DataFrame(
-            columns=["MANCODE", "BATCHID", "OPERATIONNUMBER", "INPUTINDEX", "HTML"])
-        for df in df_list:
-            sql_text = create_sql_snippet(
-                "where", ["codefab", "batchid", "numoperation", "inputindex"], df)
-
-            df_html_temp = xfp.get_html(sql_text, arch_db)
-            df_html = df_html.append(
-                df_html_temp, ignore_index=True, sort=False)
-        try:
-            # Extracting and saving (only numeric datatype)
-            for row in dataframe.loc[dataframe["DATATYPE"] == 1].itertuples():
-                html = df_html.loc[(df_html["MANCODE"] == row.MANCODE)
-                                & (df_html["BATCHID"] == row.BATCHID)
-                                & (df_html["OPERATIONNUMBER"] == row.OPERATIONNUMBER)
-                                & (df_html["INPUTINDEX"] == row.BROWSINGINDEX),
-                                "HTML"].iloc[0]
-
-                # it is null for tasks in progress
-                if not html:
-                    html = xfp.get_html_cmdtext(row)
-                    print("HTML is null")
-
-                values = cls.get_values(html, row.TAGNUMBER, row)
-                dataframe.at[row.Index, "value_min"] = values[0]
-                dataframe.at[row.Index, "value_max"] = values[1]
-                dataframe.at[row.Index, "tolerance_min"] = values[2]
-                dataframe.at[row.Index, "tolerance_max"] = values[3]
-        except IndexError as e:
-            print(e)
-            print(row)
-            raise
+        range_columns = ["value_min", "value_max", "tolerance_min", "tolerance_max"]
 
-        df_isempty = cls.params_to_values(dataframe, arch_db)
-        if df_isempty.empty:
-            return df_isempty
-        return dataframe
+        # Only numeric datatype has ranges, take what is cached first
+        df_numeric = dataframe.loc[dataframe["DATATYPE"] == 1]
+        df_cached = SpecCache.load(df_numeric)
+        if not df_cached.empty:
+            dataframe.loc[df_cached.index, range_columns] = df_cached.values
+            df_numeric = df_numeric.loc[~df_numeric.index.isin(df_cached.index)]
+        print(f"Spec ranges: {df_cached.shape[0]} cached, {df_numeric.shape[0]} to extract")
+        if not df_numeric.empty:
+            cls.extract_ranges(dataframe, df_numeric, arch_db)
 
+        return cls.params_to_values(dataframe, arch_db)
+
+
+    @classmethod
+    def extract_ranges(cls, dataframe, df_numeric, arch_db):
+        """Get task html of the df_numeric rows and save their ranges in dataframe"""
+        range_columns = ["value_min", "value_max", "tolerance_min", "tolerance_max"]
+
+        df_html = xfp.get_html(df_numeric.loc[:, [
+            "MANCODE", "BATCHID", "OPERATIONNUMBER", "BROWSINGINDEX"]].drop_duplicates(), arch_db)
+
+        html_column = cls.lookup_html(df_numeric, df_html)
+        del df_html
+        # it is null for tasks in progress, get their cmdtext in one go
+        in_progress = html_column.isna() | (html_column == "")
+        if in_progress.any():
+            html_column.loc[in_progress] = xfp.get_html_cmdtext(df_numeric.loc[in_progress])
+            print(f"HTML is null, {in_progress.sum()} parameters fell back to cmdtext")
+
+        ranges = [cls.get_values(html, row.TAGNUMBER, row)
+                  for row, html in zip(df_numeric.itertuples(), html_column)]
+        print(f"Task html parsing: {cls.get_tags.cache_info()}")
+        dataframe.loc[df_numeric.index, range_columns] = ranges
+        SpecCache.save(dataframe.loc[df_numeric.index], in_progress)
+
+    @classmethod
+    def lookup_html(cls, dataframe, df_html):
+        """
+        Task html for every row of dataframe, aligned to its index.
+        A single hash join on (MANCODE, BATCHID, OPERATIONNUMBER, INPUTINDEX),
+        rows without a task html get NaN.
+        """
+        keys = ["MANCODE", "BATCHID", "OPERATIONNUMBER", "INPUTINDEX"]
+        # the first html wins, same task instance may come from both dbs
+        df_html = df_html.drop_duplicates(subset=keys)
+        html_column = dataframe.loc[:, ["MANCODE", "BATCHID", "OPERATIONNUMBER", "BROWSINGINDEX"]] \
+            .rename(columns={"BROWSINGINDEX": "INPUTINDEX"}) \
+            .merge(df_html.loc[:, keys + ["HTML"]], how="left", on=keys)["HTML"]
+        html_column.index = dataframe.index
+        return html_column
+
+    @staticmethod
+    @lru_cache(maxsize=__HTML_CACHE_SIZE)
+    def get_tags(html):
+        """
+        Parse task html once, returns {tag id: (tolmin, tolmax, min, max)}.
+        Memoized, parameters of the same task reuse the parsed result.
+        """
+        parser = etree.HTMLParser(target=InputTags())
+        parser.feed(html)
+        return parser.close()
 
     @classmethod
     def get_values(cls, html, tagid, row):
         """Extract tolerance html tags"""
 
-        def clean(val):
-            if val == "null":
-                return None
-            return ''.join([ch for ch in val if ch not in "[]"])
-
+        # ids in the html are text, tag numbers may come as floats
+        if isinstance(tagid, float) and tagid.is_integer():
+            tagid = int(tagid)
         try:
-            soup = BeautifulSoup(html, 'lxml')
-            param = soup.find("input", {"id": tagid})
-            val_min = clean(param.get("val_min"))
-            val_max = clean(param.get("val_max"))
-            val_tolmin = clean(param.get("val_tolmin"))
-            val_tolmax = clean(param.get("val_tolmax"))
+            values = cls.get_tags(html)[str(tagid)]
+            if values is None:
+                raise KeyError(f"Missing range attributes in tag {tagid}")
         # do not exit just return nulls
-        except (AttributeError, TypeError) as e:
+        except (KeyError, TypeError, etree.LxmlError) as e:
             print(e)
             print(tagid)
             print(row)
             return (None, None, None, None)
 
-        return (val_tolmin, val_tolmax, val_min, val_max)
+        return values
@@ -0,0 +1,69 @@
+"""Lock file keeping two pipeline runs from overlapping"""
+# %%
+import os
+
+
+# %%
+class RunLock:
+    """
+    Held while a run goes, the file keeps the pid of the holder.
+    A lock left by a process that is gone is taken over.
+
+        with RunLock():
+            run()
+    """
+    __PATH = os.environ.get('RUN_LOCK_PATH', 'cpv.lock')
+
+    def __init__(self, path=None):
+        self.path = path or self.__PATH
+
+    def acquire(self):
+        """True when the lock was taken, False when another run holds it"""
+        for _ in range(2):
+            try:
+                descriptor = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self.__holder_alive():
+                    return False
+                # stale lock of a killed run
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(descriptor, "w") as file:
+                file.write(str(os.getpid()))
+            return True
+        return False
+
+    def release(self):
+        """Give the lock back"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __holder_alive(self):
+        """True when the pid in the lock file is a running process"""
+        try:
+            with open(self.path) as file:
+                pid = int(file.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return False
+        if pid <= 0:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:  # alive, owned by someone else
+            return True
+        return True
+
+    def __enter__(self):
+        if not self.acquire():
+            raise RuntimeError(f"Another run holds {self.path}")
+        return self
+
+    def __exit__(self, *args):
+        self.release()
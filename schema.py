@@ -0,0 +1,115 @@
+"""Compact column types of the extraction frames"""
+# %%
+import os
+import threading
+from distutils.util import strtobool
+import numpy as np
+import pandas as pd
+
+
+# %%
+class Schema:
+    """
+    Text keys become categoricals and integer columns get smaller types.
+    Columns of one domain, e.g. MANCODE and PO, share their categories, so
+    frames merged on them keep the categoricals and join on the codes.
+    Categories only grow during a run, apply() again moves a frame to the
+    current ones. COMPACT_DTYPES=False leaves the frames as they come.
+    """
+    __ENABLED = bool(strtobool(os.environ.get('COMPACT_DTYPES', 'True')))
+    # column: domain of its categories
+    __DOMAINS = {"MANCODE": "order", "PO": "order",
+                 "PARAMETERCODE": "parameter", "parameter": "parameter",
+                 "EMI_MASTER": "emi", "emi_master": "emi", "emi_parent": "emi",
+                 "emi_sub": "emi", "PFCCODE": "emi", "PARENTEMI": "emi", "SUBEMI": "emi",
+                 "family": "family", "area": "area", "description": "description"}
+    # column: smaller type, used when every value fits. Ids like BATCHID stay
+    # numbers, not categoricals: they are merged with the integer TASKID and
+    # BATCHID of the tasks and sorted as numbers, and an int32 takes no more
+    # room than the codes plus categories would for ids this varied
+    __INTEGERS = {"DATATYPE": "int8", "TAGNUMBER": "int16", "OPERATIONNUMBER": "int32",
+                  "BATCHID": "int32", "INPUTINDEX": "int32", "BROWSINGINDEX": "int32",
+                  "MANINDEX": "int32", "TASKID": "int32", "ELEMENTID": "int32",
+                  "PICODE": "int32"}
+    __LOCK = threading.Lock()
+    __categories = {}
+
+    @classmethod
+    def enabled(cls):
+        """True when frames are compacted"""
+        return cls.__ENABLED
+
+    @classmethod
+    def reset(cls):
+        """Forget the categories, at the start of a run"""
+        with cls.__LOCK:
+            cls.__categories = {}
+
+    @classmethod
+    def apply(cls, dataframe):
+        """Frame with the compact types, frames already up to date come back as they are"""
+        if not cls.__ENABLED or dataframe is None:
+            return dataframe
+        dtypes = {}
+        for column, dtype in dataframe.dtypes.items():
+            if column in cls.__DOMAINS and (dtype == object or dtype.name == "category"):
+                categories = cls.__register(cls.__DOMAINS[column], dataframe[column])
+                if dtype.name != "category" or not dtype.categories.equals(categories):
+                    dtypes[column] = pd.CategoricalDtype(categories)
+            elif column in cls.__INTEGERS and pd.api.types.is_integer_dtype(dtype) \
+                    and dtype.itemsize > np.dtype(cls.__INTEGERS[column]).itemsize \
+                    and cls.__fits(dataframe[column], cls.__INTEGERS[column]):
+                dtypes[column] = cls.__INTEGERS[column]
+        if not dtypes:
+            return dataframe
+        attrs = dict(dataframe.attrs)
+        dataframe = dataframe.astype(dtypes)
+        dataframe.attrs.update(attrs)
+        return dataframe
+
+    @classmethod
+    def concat(cls, frames, **kwargs):
+        """pd.concat keeping the categoricals, all frames get the same categories first"""
+        if cls.__ENABLED:
+            # categories of all frames first, then every frame is converted once
+            for frame in frames:
+                for column in frame.columns.intersection(list(cls.__DOMAINS)):
+                    if frame[column].dtype == object or frame[column].dtype.name == "category":
+                        cls.__register(cls.__DOMAINS[column], frame[column])
+        return pd.concat([cls.apply(frame) for frame in frames], **kwargs)
+
+    @staticmethod
+    def plain(dataframe):
+        """Categoricals back to text, e.g. before writing to the database"""
+        columns = [column for column, dtype in dataframe.dtypes.items()
+                   if dtype.name == "category"]
+        if not columns:
+            return dataframe
+        attrs = dict(dataframe.attrs)
+        dataframe = dataframe.astype({column: object for column in columns})
+        dataframe.attrs.update(attrs)
+        return dataframe
+
+    @classmethod
+    def __register(cls, domain, column):
+        """Categories of the domain including the column values"""
+        values = column.cat.categories if column.dtype.name == "category" \
+            else pd.Index(column.dropna().unique())
+        with cls.__LOCK:
+            categories = cls.__categories.get(domain)
+            if categories is None:
+                categories = pd.Index([], dtype=object)
+            new = values.difference(categories)
+            if len(new) or domain not in cls.__categories:
+                # appended, codes of the frames converted before stay valid
+                categories = categories.append(pd.Index(new, dtype=object))
+                cls.__categories[domain] = categories
+            return categories
+
+    @staticmethod
+    def __fits(column, dtype):
+        """True when every value of the column fits the integer type"""
+        if column.empty:
+            return True
+        limits = np.iinfo(dtype)
+        return limits.min <= column.min() and column.max() <= limits.max
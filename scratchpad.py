@@ -7,7 +7,7 @@ import pandas as pd
 from database import DataBase as db
 from ranges import Ranges
 from db_excel_upload import excel_upload
-from helpers import format_params_list, get_newest_inputdate
+from helpers import params_list, get_newest_inputdate
 from xfp import Xfp as xfp
 
 # %%
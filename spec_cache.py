@@ -0,0 +1,126 @@
+"""Persistent cache of the spec ranges extracted from task html"""
+# %%
+import os
+import sqlite3
+import pandas as pd
+from database import DataBase as db
+
+
+# %%
+class SpecCache:
+    """
+    Ranges per (MANCODE, BATCHID, OPERATIONNUMBER, INPUTINDEX, TAGNUMBER).
+    Completed tasks never change, so their ranges are extracted once.
+    Ranges taken from cmdtext of tasks in progress are saved as in_progress
+    and extracted again on the next run.
+    SPEC_CACHE selects the backend: mssql, sqlite or none.
+    """
+    __BACKEND = os.environ.get('SPEC_CACHE', 'sqlite').lower()
+    __SQLITE_PATH = os.environ.get('SPEC_CACHE_PATH', 'spec_cache.db')
+    __KEYS = ["MANCODE", "BATCHID", "OPERATIONNUMBER", "INPUTINDEX", "TAGNUMBER"]
+    __RANGES = ["value_min", "value_max", "tolerance_min", "tolerance_max"]
+
+    @classmethod
+    def enabled(cls):
+        """False when caching is switched off"""
+        return cls.__BACKEND in ("mssql", "sqlite")
+
+    @classmethod
+    def keys(cls, dataframe):
+        """Cache keys of parameter rows as text, index is kept"""
+        return pd.DataFrame({"MANCODE": dataframe["MANCODE"].astype(str),
+                             "BATCHID": dataframe["BATCHID"].astype(str),
+                             "OPERATIONNUMBER": dataframe["OPERATIONNUMBER"].astype(str),
+                             "INPUTINDEX": dataframe["BROWSINGINDEX"].astype(str),
+                             "TAGNUMBER": dataframe["TAGNUMBER"].astype(str)},
+                            index=dataframe.index)
+
+    @classmethod
+    def load(cls, dataframe):
+        """
+        Cached ranges of completed tasks for the parameter rows,
+        indexed like dataframe, rows not in the cache are left out
+        """
+        df_found = pd.DataFrame(columns=cls.__RANGES)
+        if not cls.enabled() or dataframe.empty:
+            return df_found
+
+        df_keys = cls.keys(dataframe)
+        if cls.__BACKEND == "mssql":
+            df_cache = db.get_spec_ranges(df_keys["MANCODE"])
+        else:
+            df_cache = cls.__sqlite_select(df_keys["MANCODE"].unique())
+        df_cache = df_cache.loc[df_cache["in_progress"].astype(int) == 0]
+        if df_cache.empty:
+            return df_found
+
+        df_keys["row"] = df_keys.index
+        df_found = df_keys.merge(df_cache.astype({key: str for key in cls.__KEYS}),
+                                 on=cls.__KEYS).set_index("row")
+        df_found.index.name = None
+        # empty strings come back from the mssql writer for nulls
+        return df_found.loc[:, cls.__RANGES].replace({"": None})
+
+    @classmethod
+    def save(cls, dataframe, in_progress):
+        """Save ranges of the parameter rows, in_progress is a boolean mask"""
+        if not cls.enabled() or dataframe.empty:
+            return
+        df_save = cls.keys(dataframe)
+        df_save[cls.__RANGES] = dataframe[cls.__RANGES]
+        df_save["in_progress"] = pd.Series(in_progress, index=dataframe.index).astype(int)
+        df_save = df_save.drop_duplicates(subset=cls.__KEYS, keep="last")
+        if cls.__BACKEND == "mssql":
+            try:
+                db.update_spec_ranges(df_save)
+            except Exception:  # pylint: disable=broad-except
+                # only a cache, the ranges are extracted again next time
+                print("Spec ranges not saved to the cache")
+                return
+        else:
+            cls.__sqlite_upsert(df_save)
+        print(f"Saved {df_save.shape[0]} spec ranges to the cache")
+
+    @classmethod
+    def __sqlite_connect(cls):
+        """Open the local cache, creating the table on first use"""
+        connection = sqlite3.connect(cls.__SQLITE_PATH)
+        connection.execute(f"""CREATE TABLE IF NOT EXISTS spec_ranges (
+                               {", ".join(key + " text not null" for key in cls.__KEYS)},
+                               {", ".join(col + " text" for col in cls.__RANGES)},
+                               in_progress integer not null,
+                               PRIMARY KEY ({", ".join(cls.__KEYS)}))""")
+        return connection
+
+    @classmethod
+    def __sqlite_select(cls, mancodes):
+        """Cached rows of the given process orders"""
+        frames = [pd.DataFrame(columns=cls.__KEYS + cls.__RANGES + ["in_progress"])]
+        connection = cls.__sqlite_connect()
+        try:
+            # sqlite allows 999 bound variables per statement
+            for start in range(0, len(mancodes), 900):
+                orders = list(mancodes[start:start + 900])
+                frames.append(pd.read_sql_query(
+                    f"""select * from spec_ranges
+                        where MANCODE in ({", ".join("?" * len(orders))})""",
+                    connection, params=orders))
+        finally:
+            connection.close()
+        return pd.concat(frames, ignore_index=True, sort=False)
+
+    @classmethod
+    def __sqlite_upsert(cls, dataframe):
+        """Insert or replace rows"""
+        columns = cls.__KEYS + cls.__RANGES + ["in_progress"]
+        connection = cls.__sqlite_connect()
+        try:
+            with connection:
+                connection.executemany(
+                    f"""INSERT OR REPLACE INTO spec_ranges ({", ".join(columns)})
+                        VALUES ({", ".join("?" * len(columns))})""",
+                    dataframe.loc[:, columns].astype(object)
+                    .where(dataframe.loc[:, columns].notna(), None)
+                    .itertuples(index=False, name=None))
+        finally:
+            connection.close()
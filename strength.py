@@ -0,0 +1,82 @@
+"""Product strength from the process order description"""
+# %%
+import json
+import os
+import re
+import threading
+import pandas as pd
+
+
+# %%
+class Strength:
+    """
+    Parses the strength out of order descriptions with precompiled
+    patterns, vectorized over all descriptions not seen before.
+    Parsed descriptions are kept in a json memo (STRENGTH_MEMO_PATH),
+    so each distinct description is parsed only once.
+    """
+    __MEMO_PATH = os.environ.get('STRENGTH_MEMO_PATH', 'strength_memo.json')
+    # tried in order, the first one matching wins
+    __PATTERNS = [re.compile(r"(\d*[.,]?\d+(MG)?\s?[+/]{1}\s?\d+[.,]?\d*(MG)?)", re.IGNORECASE),
+                  re.compile(r"(\s\d*[.,]?\d+(\s|MG){1})", re.IGNORECASE),
+                  re.compile(r"((\s|[a-zA-Z])\d*[.,]?\d+(\s|GC){1})", re.IGNORECASE),
+                  re.compile(r"OD(\d*[.,]?\d+)", re.IGNORECASE)]
+    __CLEAN = [(re.compile(r"\s+"), ""),
+               (re.compile(r"(MG|mg|Mg|gM|[A-Za-z]){1}"), ""),
+               (re.compile(r"(/|//)"), "+"),
+               (re.compile(","), ".")]
+    __memo = None
+    __lock = threading.Lock()
+
+    @classmethod
+    def get_strength(cls, descriptions):
+        """Strength for every description, 0 when there is none"""
+        with cls.__lock:
+            memo = cls.__load()
+            unique = pd.Series(descriptions.dropna().unique(), dtype=object)
+            new = unique.loc[~unique.isin(list(memo))]
+            if not new.empty:
+                memo.update(zip(new, cls.parse(new)))
+                cls.__save()
+                print(f"Parsed strength of {new.size} new descriptions")
+        return descriptions.map(memo).fillna(0)
+
+    @classmethod
+    def parse(cls, descriptions):
+        """Parse the descriptions, no memo involved"""
+        strength = pd.Series(None, index=descriptions.index, dtype=object)
+        for pattern in cls.__PATTERNS:
+            todo = strength.isna()
+            if not todo.any():
+                break
+            strength.loc[todo] = descriptions.loc[todo].str.extract(pattern, expand=True)[0]
+        found = strength.notna()
+        for pattern, replacement in cls.__CLEAN:
+            strength.loc[found] = strength.loc[found].str.replace(pattern, replacement,
+                                                                  regex=True)
+        return strength.where(found, 0).tolist()
+
+    @classmethod
+    def __load(cls):
+        """Read the memo once, dropped when the patterns have changed"""
+        if cls.__memo is None:
+            cls.__memo = {}
+            if os.path.exists(cls.__MEMO_PATH):
+                with open(cls.__MEMO_PATH) as file:
+                    saved = json.load(file)
+                if saved.get("patterns") == cls.__pattern_list():
+                    cls.__memo = saved["memo"]
+        return cls.__memo
+
+    @classmethod
+    def __save(cls):
+        """Write the memo, replacing the file in one step"""
+        with open(cls.__MEMO_PATH + ".tmp", "w") as file:
+            json.dump({"patterns": cls.__pattern_list(), "memo": cls.__memo}, file)
+        os.replace(cls.__MEMO_PATH + ".tmp", cls.__MEMO_PATH)
+
+    @classmethod
+    def __pattern_list(cls):
+        """Patterns as text, to tell whether the memo is still valid"""
+        return [pattern.pattern for pattern in cls.__PATTERNS] + \
+            [pattern.pattern for pattern, _ in cls.__CLEAN]
@@ -0,0 +1,81 @@
+"""AggregateState.update: running aggregates, recounts and new groups"""
+# %%
+import pandas as pd
+import pytest
+from aggregate_state import AggregateState
+
+
+# %%
+def member_rows(*rows):
+    """Special parameter rows, (groupid, subemi, inputindex, value) each"""
+    return pd.DataFrame([{
+        "MANCODE": "1000001", "EMI_MASTER": "EMI0", "PARENTEMI": "PARENT",
+        "SUBEMI": subemi, "BATCHID": 1, "PARAMETERCODE": f"P{groupid}",
+        "description": f"group {groupid}", "family": "FAMILY", "area": "AREA",
+        "agg_function": "AVG", "dataformat": "mg", "groupid": groupid,
+        "INPUTINDEX": inputindex,
+        "INPUTDATE": pd.Timestamp("2019-07-01") + pd.Timedelta(hours=inputindex),
+        "VALUE": str(value), "value_min": "1", "value_max": "99",
+        "tolerance_min": None, "tolerance_max": None}
+                         for groupid, subemi, inputindex, value in rows])
+
+
+def group(groups, groupid):
+    """Stored aggregate of one group"""
+    return groups.loc[groups["groupid"] == groupid].iloc[0]
+
+
+@pytest.fixture
+def state():
+    """State of group 1 with two members, 10 and 30"""
+    _, members, groups = AggregateState.update(member_rows((1, "A", 1, 10),
+                                                           (1, "B", 2, 30)))
+    return members, groups
+
+
+# %%
+def test_new_member_updates_running_aggregate(state, capsys):
+    output, members, groups = AggregateState.update(member_rows((1, "C", 3, 50)), *state)
+    assert "1 updated, 0 recounted" in capsys.readouterr().out
+    stored = group(groups, 1)
+    assert (stored["MIN"], stored["MAX"], stored["SUM"], stored["COUNT"]) == (10, 50, 90, 3)
+    assert stored["INPUTDATE"] == pd.Timestamp("2019-07-01 03:00")
+    assert members.shape[0] == 3
+    assert output["VALUE"].tolist() == [30]
+
+
+def test_replaced_member_recounts_group(state, capsys):
+    # B was the max, a running max would keep 30
+    output, members, groups = AggregateState.update(member_rows((1, "B", 3, 20)), *state)
+    assert "0 updated, 1 recounted" in capsys.readouterr().out
+    stored = group(groups, 1)
+    assert (stored["MIN"], stored["MAX"], stored["SUM"], stored["COUNT"]) == (10, 20, 30, 2)
+    assert members.shape[0] == 2
+    assert output["VALUE"].tolist() == [15]
+
+
+def test_older_input_is_left_out(state):
+    _, _, groups = AggregateState.update(member_rows((1, "B", 1, 500)), *state)
+    assert group(groups, 1)["MAX"] == 30
+
+
+def test_same_rows_again_do_not_double_count(state):
+    members, groups = state
+    _, members_again, groups_again = AggregateState.update(
+        member_rows((1, "A", 1, 10), (1, "B", 2, 30)), members, groups)
+    stored = group(groups_again, 1)
+    assert (stored["SUM"], stored["COUNT"]) == (40, 2)
+    assert members_again.shape[0] == members.shape[0]
+    assert groups_again.shape[0] == groups.shape[0]
+
+
+def test_group_not_in_state_is_computed_from_scratch(state, capsys):
+    output, _, groups = AggregateState.update(
+        member_rows((2, "A", 5, 4), (2, "B", 6, 8), (2, "B", 4, 100)), *state)
+    assert "0 updated, 1 recounted" in capsys.readouterr().out
+    stored = group(groups, 2)
+    # the older input of B is not a member
+    assert (stored["MIN"], stored["MAX"], stored["SUM"], stored["COUNT"]) == (4, 8, 12, 2)
+    assert group(groups, 1)["COUNT"] == 2
+    assert output["groupid"].tolist() == [2]
+    assert output["VALUE"].tolist() == [6]
@@ -0,0 +1,35 @@
+"""Checkpoint: saved stages and pruning of old runs"""
+# %%
+import os
+import pandas as pd
+import pytest
+from checkpoint import Checkpoint
+
+
+# %%
+@pytest.fixture
+def root(tmp_path):
+    """Four saved runs, run0 the oldest"""
+    for number in range(4):
+        # as Checkpoint.new, with ids in a known order
+        os.makedirs(tmp_path / f"run{number}")
+        Checkpoint(str(tmp_path), f"run{number}", {"redo": False}).save("prepare", {})
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize("keep, left", [(3, ["run1", "run2", "run3"]), (1, ["run3"]),
+                                        (0, ["run3"]), (-2, ["run3"]),
+                                        (10, ["run0", "run1", "run2", "run3"])])
+def test_prune_keeps_latest_runs(root, keep, left):
+    Checkpoint.prune(root, keep)
+    assert Checkpoint.runs(root) == left
+
+
+def test_saved_stage_loads_in_resumed_run(tmp_path):
+    os.makedirs(tmp_path / "run0")
+    checkpoint = Checkpoint(str(tmp_path), "run0", {"redo": True})
+    checkpoint.save("orders", {"orders": pd.DataFrame({"PO": ["1000001"], "QTY": [2]})})
+    resumed = Checkpoint.open(str(tmp_path))
+    assert resumed.run_id == "run0" and resumed.info == {"redo": True}
+    assert resumed.done("orders") and not resumed.done("write")
+    assert resumed.load("orders")["orders"].to_dict("list") == {"PO": ["1000001"], "QTY": [2]}
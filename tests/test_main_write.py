@@ -0,0 +1,89 @@
+"""main.run: a failed database write leaves the run resumable"""
+# %%
+import contextlib
+import os
+import pandas as pd
+import pytest
+
+pytest.importorskip("cx_Oracle")
+# settings main and database read at import, no database is used
+for _key in ["DB", "PORT", "HOST", "USERNAME", "PASSWORD", "XFP_DB_SID",
+             "XFP_DB_IP", "XFP_DB_PORT", "XFP_USERNAME", "XFP_PASSWORD"]:
+    os.environ.setdefault(_key, "")
+os.environ.setdefault("REDO_EVERYTHING", "False")
+os.environ.setdefault("USE_ARCH_DB", "False")
+
+import main  # pylint: disable=wrong-import-position
+from checkpoint import Checkpoint  # pylint: disable=wrong-import-position
+from database import DataBase as db  # pylint: disable=wrong-import-position
+
+
+# %%
+class FailingConnection:
+    """MSSQL connection whose statements all fail, also as DBAPI connection and cursor"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def begin(self):
+        return contextlib.nullcontext(self)
+
+    def raw_connection(self):
+        return self
+
+    def cursor(self):
+        return self
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+    def execute(self, *args, **kwargs):
+        raise RuntimeError("MSSQL down")
+
+
+def frames(info, data):
+    """Stage output ready for write"""
+    return {"params_main": pd.DataFrame({
+        "MANCODE": ["1000001"], "family": ["FAMILY"], "area": ["AREA"],
+        "description": ["P101"], "VALUE": ["10"], "dataformat": ["mg"],
+        "INPUTDATE": ["2019-07-01 00:00:00"], "value_min": [None], "value_max": [None],
+        "tolerance_min": [None], "tolerance_max": [None]}),
+            "params_special": pd.DataFrame(),
+            "orders": pd.DataFrame({"PO": ["1000001"]})}
+
+
+@pytest.fixture
+def saved(monkeypatch, tmp_path):
+    """Key values and order watermark saved by the run"""
+    values = {}
+    monkeypatch.setattr(main, "CHECKPOINT_PATH", str(tmp_path))
+    monkeypatch.setattr(main, "STAGES", [("prepare", frames), ("write", main.write)])
+    monkeypatch.setattr(db, "connect", classmethod(lambda cls: FailingConnection()))
+    monkeypatch.setattr(db, "get_engine", classmethod(lambda cls: FailingConnection()))
+    monkeypatch.setattr(db, "check_row_hash", classmethod(lambda cls, table: None))
+    monkeypatch.setattr(db, "select", classmethod(lambda cls, query, params=None: pd.DataFrame(
+        columns=["PO", "family", "area", "parameter", "row_hash"])))
+    monkeypatch.setattr(db, "get_key_value", classmethod(lambda cls, key, default=None: default))
+    monkeypatch.setattr(db, "save_key_value",
+                        classmethod(lambda cls, key, value: values.__setitem__(key, value)))
+    return values
+
+
+# %%
+@pytest.mark.parametrize("bulk", [True, False])
+def test_failed_write_is_not_checkpointed(saved, tmp_path, monkeypatch, bulk):
+    # bulk_update batches or one MERGE per row
+    monkeypatch.setattr(main, "BULK_WRITE", bulk)
+    with pytest.raises(RuntimeError, match="MSSQL down"):
+        main.run(redo=False)
+    checkpoint = Checkpoint.open(str(tmp_path))
+    assert checkpoint.done("prepare")
+    assert not checkpoint.done("write")
+    # nothing moves on, the resumed run writes the same rows again
+    assert saved == {}
@@ -1,190 +1,404 @@
 """Select queries on the XFP database"""
 # %%
 import datetime
-import re
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from distutils.util import strtobool
+from timeit import default_timer as timer
 import pandas as pd
 from database import DataBase as db
-from helpers import trim_all_columns, create_sql_snippet, create_sql_list
+from helpers import trim_all_columns, key_filter, key_values, params_list
+from pidata_mirror import PidataMirror
+from schema import Schema
+from strength import Strength
 
 # %%
 class Xfp:
     """Select queries on the XFP database"""
+    __PRD_DB = "ELAN2406PRD"
+    __ARCH_DB = "ARCH2406PRD"
+    __PARALLEL = int(os.environ.get('XFP_PARALLEL', '2'))
+    # latest input per key picked in the query, False leaves it to pandas
+    __LATEST = bool(strtobool(os.environ.get('XFP_LATEST', 'True')))
+    # (partition by, order by) of the latest input modes of get_parameters
+    LATEST_MAIN = ("mancode, parametercode", "inputdate desc, inputindex desc")
+    LATEST_SPECIAL = ("mancode, batchid, operationnumber, parametercode", "inputindex desc")
+    LATEST_BATCH = ("mancode, batchid, parametercode", "inputindex desc")
+    # numbers rounded to 2 decimals without trailing zeros, the dot is trimmed after
+    __NUMBER_FORMAT = "FM999999999999999999990.99"
+    # low bound of the partition of the rows without a value in its column
+    IS_NULL = "is null"
 
     @staticmethod
-    def get_html_cmdtext(row):
+    def run_schemas(get_string, arch_db, chunksize=None, clean=None, binds=None, trim=False):
+        """
+        Runs the query get_string(dbname) on production and, if arch_db,
+        on the archive, concurrently on separate pooled sessions.
+        clean is applied to each chunk and the chunk is compacted (Schema)
+        as it arrives, so the chunks kept until the merge are the compact ones.
+        Queries are expected to TRIM() their text columns, else trim=True.
+        """
+        dbnames = [Xfp.__PRD_DB]
+        if arch_db:
+            dbnames.append(Xfp.__ARCH_DB)
+
+        def run(dbname):
+            start = timer()
+            frames = [Schema.apply(clean(df) if clean else df)
+                      for df in db.xfp_run_sql_chunks(get_string(dbname), chunksize,
+                                                      binds=binds, trim=trim)]
+            dataframe = Xfp.__concat(frames)
+            print(f"Got {dataframe.shape[0]} rows from {dbname} "
+                  f"in {round(timer() - start, 2)} s")
+            return dataframe
+
+        with ThreadPoolExecutor(max_workers=max(min(Xfp.__PARALLEL, len(dbnames)), 1)) \
+                as executor:
+            futures = [executor.submit(run, dbname) for dbname in dbnames]
+            # production first whatever finishes first, drop_duplicates keeps its rows
+            frames = [future.result() for future in futures]
+        dataframe = Xfp.__concat(frames).drop_duplicates().reset_index(drop=True)
+        dataframe.attrs["trimmed"] = True
+        return dataframe
+
+    @staticmethod
+    def __concat(frames):
+        """Concatenates query results, empty ones are left out"""
+        # an empty result has object columns, it would turn numbers into objects
+        frames = [frame for frame in frames if not frame.empty] or frames[:1]
+        return Schema.concat(frames, ignore_index=True, sort=False)
+
+    @staticmethod
+    def get_html_cmdtext(dataframe):
         """
         For EMI tasks the html is saved to e2s_pitext_man only after task is completed
         so for tasks in progress there is a need no extract spec values from the e2s_pidata_man
         able. Note it can't be done for all as cmdtext column may be null once task is completed.
         As this is only for in porogress task no need to query the archive db.
+        Returns cmdtext for every row of dataframe, aligned to its index.
         """
-        sql = f"""select cmdtext from elan2406prd.e2s_pidata_man where
-                    mancode = '{row.MANCODE}'
-                    and batchid = '{row.BATCHID}'
-                    and parametercode = '{row.PARAMETERCODE}'
-                    and inputindex = '{row.INPUTINDEX}'
-                    and operationnumber = '{row.OPERATIONNUMBER}'
-                    and browsingindex = '{row.BROWSINGINDEX}'"""
-        try:
-            return db.xfp_run_sql(sql).iat[0, 0]
-        except IndexError as e:
-            print("Inside of get_html_cmdtext")
-            print(e)
-            print(row)
-            print("\n")
-            return None
+        keys = ["MANCODE", "BATCHID", "PARAMETERCODE",
+                "INPUTINDEX", "OPERATIONNUMBER", "BROWSINGINDEX"]
+        binds = {"orders": params_list(dataframe["MANCODE"]),
+                 "keys": key_values(dataframe, keys)}
+        sql = f"""select trim(mancode) as mancode, batchid,
+                    trim(parametercode) as parametercode, inputindex,
+                    operationnumber, browsingindex, cmdtext
+                    from {Xfp.__PRD_DB}.e2s_pidata_man
+                    {key_filter("where", ["mancode"], "orders")}
+                    {key_filter("and", ["mancode", "batchid", "parametercode", "inputindex",
+                                        "operationnumber", "browsingindex"], "keys")}"""
+        df_cmd = db.xfp_run_sql(sql, binds=binds, trim=False).drop_duplicates(subset=keys)
+        cmdtext = dataframe.loc[:, keys] \
+            .merge(df_cmd.astype(dataframe.loc[:, keys].dtypes.to_dict()),
+                   how="left", on=keys)["CMDTEXT"]
+        cmdtext.index = dataframe.index
+        return cmdtext
 
 
     @staticmethod
-    def get_html(sql_text, arch_db):
-        """Extracts content of EMI tasks to use to extract parameters ranges"""
+    def get_html(dataframe, arch_db):
+        """
+        Extracts content of EMI tasks to use to extract parameters ranges,
+        tasks are given by MANCODE, BATCHID, OPERATIONNUMBER, BROWSINGINDEX
+        """
+        binds = {"orders": params_list(dataframe["MANCODE"]),
+                 "tasks": key_values(dataframe, ["MANCODE", "BATCHID",
+                                                 "OPERATIONNUMBER", "BROWSINGINDEX"])}
 
-        def get_string(dbname, sql_text):
-            return f"""select codefab as mancode, batchid,
+        def get_string(dbname):
+            return f"""select trim(codefab) as mancode, batchid,
                         numoperation as OPERATIONNUMBER,
                         inputindex,
                         texte as html
                         from {dbname}.e2s_pitext_man
-                        {sql_text}"""
+                        {key_filter("where", ["codefab"], "orders")}
+                        {key_filter("and", ["codefab", "batchid", "numoperation", "inputindex"],
+                                    "tasks")}"""
 
-        sql_string = get_string("ELAN2406PRD", sql_text)
-        df_prd = db.xfp_run_sql(sql_string)
-        if arch_db:
-            sql_string = get_string("ARCH2406PRD", sql_text)
-            df_arch = db.xfp_run_sql(sql_string)
-            df_tasks = pd.concat([df_prd, df_arch],
-                                ignore_index=True,
-                                sort=False) \
-                .drop_duplicates().reset_index(drop=True)
-        else:
-            df_tasks = df_prd.drop_duplicates().reset_index(drop=True)
-        return df_tasks
+        return Xfp.run_schemas(get_string, arch_db, binds=binds)
 
 
 
     @staticmethod
-    def get_orders(arch_db=True):
-        """Get work orders from XFP"""
-
-        sql_po_prd = """select o.numof as po, o.codeproduit as material,
-                        o.numlotpharma as batch,
-                        o.designationproduit as description,
+    def get_orders(arch_db=True, chunksize=None, since=None, orders=None):
+        """
+        Get work orders from XFP, all of them or only the ones
+        created since the given time plus the given orders
+        """
+        binds = {}
+        filters = []
+        if since:
+            binds["since"] = str(since)
+            filters.append("o.dtdatecreaparsyst >= TO_DATE(:since, 'yyyy-mm-dd hh24:mi:ss')")
+        if orders:
+            binds["orders"] = list(orders)
+            filters.append(key_filter("", ["o.numof"], "orders").strip())
+        sql_delta = f"and ({' or '.join(filters)})" if filters else ""
+
+        def get_string(dbname):
+            return f"""select trim(o.numof) as po, trim(o.codeproduit) as material,
+                        trim(o.numlotpharma) as batch,
+                        trim(o.designationproduit) as description,
                         o.dtdatecreaparsyst as po_launchdate,
-                        o.codemo as emi_master,
+                        trim(o.codemo) as emi_master,
                         o.quantiteof as order_qty,
-                        o.uniteof as unit
-                        from ELAN2406PRD.xfp_ofentete o
+                        trim(o.uniteof) as unit
+                        from {dbname}.xfp_ofentete o
                         where o.indiceof = 0 and o.etat in ('F', 'S', 'E')
+                        {sql_delta}
                         """
 
-        df_po_prd = db.xfp_run_sql(sql_po_prd)
+        df_po = Xfp.run_schemas(get_string, arch_db, chunksize, binds=binds or None)
 
-        if arch_db:
-            sql_po_arch = """select o.numof as po, o.codeproduit as material,
-                o.numlotpharma as batch,
-                o.designationproduit as description,
-                o.dtdatecreaparsyst as po_launchdate,
-                o.codemo as emi_master,
-                o.quantiteof as order_qty,
-                o.uniteof as unit
-                from arch2406PRD.xfp_ofentete o
-                where o.indiceof = 0 and o.etat in ('F', 'S', 'E')
-                """
-            df_po_arch = db.xfp_run_sql(sql_po_arch)
-            df_po = pd.concat([df_po_prd, df_po_arch],
-                              ignore_index=True,
-                              sort=False).drop_duplicates().reset_index(drop=True)
-        else:
-            df_po = df_po_prd.drop_duplicates().reset_index(drop=True)
-
-
-        def get_strength(value):
-                    """Get product strength from the description"""
-                    def clean(value):
-                        value = re.sub(r"\s+", "", value)
-                        value = re.sub(r"(MG|mg|Mg|gM|[A-Za-z]){1}", "", value)
-                        value = re.sub(r"(/|//)", "+", value)
-                        value = re.sub(",", ".", value)
-                        return value
-                    try:
-                        strength = ""
-                        strength = re.search(
-                            r"(\d*[.,]?\d+(MG)?\s?[+/]{1}\s?\d+[.,]?\d*(MG)?)", value, re.IGNORECASE)
-                        if not strength:
-                            strength = re.search(
-                                r"(\s\d*[.,]?\d+(\s|MG){1})", value, re.IGNORECASE)
-                        if not strength:
-                            strength = re.search(
-                                r"((\s|[a-zA-Z])\d*[.,]?\d+(\s|GC){1})", value, re.IGNORECASE)
-                        if not strength:
-                            strength = re.search(
-                                r"OD(\d*[.,]?\d+)", value, re.IGNORECASE)
-
-                        if strength:
-                            return clean(strength.group(1))
-                        return 0
-                    except AttributeError:
-                        return 0
 
         # add column with product strenght
-        df_po["STRENGTH"] = df_po["DESCRIPTION"].apply(get_strength)
+        df_po["STRENGTH"] = Strength.get_strength(df_po["DESCRIPTION"])
+
+        return Schema.apply(trim_all_columns(df_po))
+
+    @staticmethod
+    def get_parameters(redo, time=None, params=None, orders=None, chunksize=None,
+                       partition=None, latest=None):
+        """
+        Get parameters from XFP, or from the local mirror when there is one.
+        latest, one of the LATEST_ modes, only brings the last input per key,
+        the mirror and XFP_LATEST=False bring all inputs.
+        """
+        if PidataMirror.enabled():
+            return Xfp.clean_parameters(PidataMirror.read(time, params, orders, partition))
+        get_string, binds = Xfp.parameters_sql(time, params, orders, partition,
+                                               latest if Xfp.__LATEST else None)
+        if redo:
+            print("Getting parameters from the XFP Archive DB")
+        return Xfp.run_schemas(get_string, redo, chunksize,
+                               clean=Xfp.clean_parameters, binds=binds)
+
+    @staticmethod
+    def latest_enabled():
+        """True when the latest input modes are run in the query"""
+        return Xfp.__LATEST and not PidataMirror.enabled()
 
-        return trim_all_columns(df_po)
+    @staticmethod
+    def count_parameters(since):
+        """Number of parameters entered in production since the given time"""
+        sql = f"""select count(*) as backlog from {Xfp.__PRD_DB}.e2s_pidata_man
+                    where tagnumber <> 0 and forced = 0
+                    and inputdate >= TO_DATE(:since, 'yyyy-mm-dd hh24:mi:ss')"""
+        return int(db.xfp_run_sql(sql, binds={"since": str(since)})["BACKLOG"].iloc[0])
 
     @staticmethod
-    def get_parameters(redo, time=None, params=None, orders=None):
-        """Get parameters from XFP"""
+    def sync_mirror(chunksize=None):
+        """
+        Add the parameters entered since the last sync to the local mirror,
+        the first sync copies both schemas, later ones only production
+        """
+        since = PidataMirror.watermark()
+        # UTC like the XFP database, taken before the query
+        synced = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        get_string, binds = Xfp.parameters_sql(time=since, raw=True)
+        dbnames = [Xfp.__PRD_DB] if since else [Xfp.__PRD_DB, Xfp.__ARCH_DB]
+        for dbname in dbnames:
+            start = timer()
+            rows = 0
+            for df_chunk in db.xfp_run_sql_chunks(get_string(dbname), chunksize,
+                                                  binds=binds, trim=False):
+                rows += df_chunk.shape[0]
+                PidataMirror.append(df_chunk)
+            print(f"Mirrored {rows} params from {dbname} since {since} "
+                  f"in {round(timer() - start, 2)} s")
+        PidataMirror.finish_sync(synced)
+
+    @staticmethod
+    def parameters_sql(time=None, params=None, orders=None, partition=None, latest=None,
+                       raw=False):
+        """
+        Returns function building the parameters query for a schema and
+        its bind variables. Orders and params are lists of values,
+        latest is a (partition by, order by) pair keeping the first row per key.
+        The query gives the formatted VALUE of the valid inputs only,
+        raw=True gives numvalue, datevalue and textvalue of all inputs instead.
+        Invalid inputs are always left out before the latest row is picked,
+        otherwise an empty last input would hide the valid one before it.
+        """
 
-        # if there is df there realy should be no orders or params
+        # everything goes in binds so the statement text stays the same
         sql_text = ""
-        # if df is not None:
-        #     sql_text = create_sql_snippet("and", ["mancode", "batchid", "parametercode"], df)
-        # else:
+        binds = {}
         if orders:
-            orders = create_sql_list("and", "mancode", orders)
-            sql_text += orders
+            sql_text += key_filter("and", ["mancode"], "orders")
+            binds["orders"] = list(orders)
         if params:
-            params = create_sql_list("and", "parametercode", params)
-            sql_text += params
+            sql_text += key_filter("and", ["parametercode"], "params")
+            binds["params"] = list(params)
 
         if time:
-            time = f"""and inputdate >= TO_DATE('{time}',
-                      'yyyy-mm-dd hh24:mi:ss')"""
+            binds["since"] = str(time)
+            time = "and inputdate >= TO_DATE(:since, 'yyyy-mm-dd hh24:mi:ss')"
         else:
             time = ""
 
-        def get_string(dbname, sql_text, time):
-            return f"""select picode as picode, mancode, batchid,
-                            parametercode as parametercode, inputindex,
+        # (column, low, high), low inclusive, high exclusive, None is open
+        if partition and partition[1] == Xfp.IS_NULL:
+            sql_text += f"and {partition[0]} is null\n"
+        elif partition:
+            column, low, high = partition
+            bound = "TO_DATE(:{}, 'yyyy-mm-dd hh24:mi:ss')" if column == "inputdate" else ":{}"
+            if low:
+                sql_text += f"and {column} >= {bound.format('low')}\n"
+                binds["low"] = low
+            if high:
+                sql_text += f"and {column} < {bound.format('high')}\n"
+                binds["high"] = high
+
+        # as clean_parameters, for some reason there are some strange dates in the database
+        year = "to_char(datevalue, 'YYYY')"
+        valid = f"""and (datatype = 0 and trim(textvalue) is not null
+                          or datatype = 2 and datevalue is not null
+                             and not ({year} like '0%' or {year} like '28%' or {year} = '1900')
+                          or datatype not in (0, 2) and numvalue is not null)""" \
+            if latest or not raw else ""
+        if raw:
+            values = "numvalue, datevalue, trim(textvalue) as textvalue"
+            columns = "numvalue, datevalue, textvalue"
+        else:
+            values = f"""case when datatype = 0 then trim(textvalue)
+                              when datatype = 2 then
+                                  to_char(datevalue, 'DD-MM-YYYY HH24:MI:SS')
+                              else rtrim(to_char(round(numvalue, 2),
+                                                 '{Xfp.__NUMBER_FORMAT}'), '.')
+                         end as value"""
+            columns = "value"
+        columns = f"""picode, mancode, batchid, parametercode, inputindex,
+                      inputdate, operationnumber, tagnumber, datatype,
+                      {columns}, browsingindex"""
+
+        def get_string(dbname):
+            sql = f"""select picode as picode, trim(mancode) as mancode, batchid,
+                            trim(parametercode) as parametercode, inputindex,
                             inputdate, operationnumber, tagnumber, datatype,
-                            numvalue, datevalue,
-                            textvalue as textvalue,
+                            {values},
                             browsingindex
                             from {dbname}.e2s_pidata_man
                             where tagnumber <> 0 --filter out output parameters
                             and forced = 0
+                            {valid}
                             {sql_text}
                             {time}"""
+            if latest:
+                sql = f"""select {columns} from (
+                            select {columns},
+                                row_number() over (partition by {latest[0]}
+                                                   order by {latest[1]}) as latest_row
+                            from ({sql})) where latest_row = 1"""
+            return sql
 
-        sql_string = get_string("ELAN2406PRD", sql_text, time)
-        df_prd = db.xfp_run_sql(sql_string)
-        print(f"Got {df_prd.shape[0]} params frpm XFP prod")
+        return get_string, binds
 
-        if redo:
-            print("Getting parameters from the XFP Archive DB")
-            sql_string = get_string("ARCH2406PRD", sql_text, time)
-            df_arch = db.xfp_run_sql(sql_string)
-            print(f"Got {df_arch.shape[0]} params frpm XFP archive")
-            df_params = pd.concat([df_prd, df_arch],
-                                  ignore_index=True,
-                                  sort=False) \
-                .drop_duplicates().reset_index(drop=True)
+    @staticmethod
+    def get_partitions(by, count):
+        """
+        Split all parameters into count partitions by inputdate window or
+        mancode range. Partitions are (column, low, high) and together
+        cover everything, the first and last ones are open ended and
+        (column, IS_NULL, None) has the rows without a value in the column.
+        """
+        if by == "inputdate":
+            def get_string(dbname):
+                return f"""select min(inputdate) as low, max(inputdate) as high
+                           from {dbname}.e2s_pidata_man"""
+            df_bounds = Xfp.run_schemas(get_string, True)
+            low = pd.Timestamp(df_bounds["LOW"].min())
+            high = pd.Timestamp(df_bounds["HIGH"].max())
+            step = (high - low) / count
+            bounds = [(low + step * i).strftime("%Y-%m-%d %H:%M:%S")
+                      for i in range(1, count)]
+        elif by == "mancode":
+            sql = f"""select min(mancode) as low from (
+                        select mancode, ntile({count}) over (order by mancode) as part
+                        from (select mancode from {Xfp.__PRD_DB}.e2s_pidata_man
+                              union
+                              select mancode from {Xfp.__ARCH_DB}.e2s_pidata_man))
+                      group by part order by part"""
+            bounds = db.xfp_run_sql(sql)["LOW"].tolist()[1:]
         else:
-            df_params = df_prd.drop_duplicates().reset_index(drop=True)
+            raise ValueError(f"Unknown partitioning {by}")
+        bounds = [None] + bounds + [None]
+        return [(by, bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)] + \
+            [(by, Xfp.IS_NULL, None)]
+
+    @staticmethod
+    def get_parameters_partitioned(params, by, count, workers, checkpoint_dir, latest=None):
+        """
+        Full extraction of parameters from both databases split into
+        partitions run by a pool of workers. Every finished partition is
+        saved to checkpoint_dir, a rerun only extracts the missing ones.
+        latest as in get_parameters, it applies within every partition.
+        Saved partitions of another parameter list or latest mode are dropped.
+        """
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        manifest = os.path.join(checkpoint_dir, "partitions.json")
+        key = {"by": by, "count": count, "latest": list(latest) if latest else None,
+               "params": hashlib.md5("\n".join(sorted(map(str, params or [])))
+                                     .encode("utf-8")).hexdigest()}
+        partitions = None
+        if os.path.exists(manifest):
+            with open(manifest) as file:
+                saved = json.load(file)
+            if all(saved.get(name) == value for name, value in key.items()):
+                partitions = [tuple(partition) for partition in saved["partitions"]]
+                print(f"Resuming partitioned extraction from {checkpoint_dir}")
+        if partitions is None:
+            Xfp.clear_checkpoints(checkpoint_dir)
+            os.makedirs(checkpoint_dir, exist_ok=True)
+            partitions = Xfp.get_partitions(by, count)
+            with open(manifest + ".tmp", "w") as file:
+                json.dump(dict(key, partitions=partitions), file)
+            os.replace(manifest + ".tmp", manifest)
+
+        def run(number, partition):
+            path = os.path.join(checkpoint_dir, f"params_{number:04d}.pkl")
+            if os.path.exists(path):
+                return pd.read_pickle(path)
+            start = timer()
+            df_part = Xfp.get_parameters(redo=True, params=params, partition=partition,
+                                         latest=latest)
+            # write then rename so a killed run never leaves half a file
+            df_part.to_pickle(path + ".tmp")
+            os.replace(path + ".tmp", path)
+            print(f"Partition {number + 1}/{len(partitions)} {partition}: "
+                  f"{df_part.shape[0]} params in {round(timer() - start, 2)} s")
+            return df_part
+
+        frames = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run, number, partition)
+                       for number, partition in enumerate(partitions)]
+            for future in as_completed(futures):
+                frames.append(future.result())
+        return Schema.concat(frames, ignore_index=True, sort=False) \
+            .drop_duplicates().reset_index(drop=True)
+
+    @staticmethod
+    def clear_checkpoints(checkpoint_dir):
+        """Remove partition checkpoints once the run is saved"""
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+    @staticmethod
+    def clean_parameters(df_params):
+        """
+        Drop invalid values and save the actual value in the VALUE column,
+        for raw inputs like the mirror ones. Parameters queries give VALUE already.
+        """
 
         # Exit early if df is empty
         if df_params.empty:
             return df_params
+        if "NUMVALUE" not in df_params:
+            return Schema.apply(df_params)
 
         # for some reason there are some strange dates in the database
         df_params.drop(df_params.loc[(df_params["DATATYPE"] == 2) &
@@ -201,42 +415,32 @@ class Xfp:
                        inplace=True, axis=0)
 
         # Rounding
-        df_params["NUMVALUE"] = df_params["NUMVALUE"].round(2)
+        df_params["NUMVALUE"] = pd.to_numeric(df_params["NUMVALUE"]).round(2)
 
         # check and save an actual value
         df_params["VALUE"] = df_params["NUMVALUE"]
         df_params.loc[df_params["DATATYPE"] == 0, "VALUE"] = \
             df_params["TEXTVALUE"]
-        df_params.loc[df_params["DATATYPE"] == 2, "VALUE"] = \
-            df_params["DATEVALUE"].dt.strftime('%d-%m-%Y %H:%M:%S')
+        # a chunk may have no dates at all, so convert before using .dt
+        is_date = df_params["DATATYPE"] == 2
+        df_params.loc[is_date, "VALUE"] = \
+            pd.to_datetime(df_params.loc[is_date, "DATEVALUE"]).dt.strftime('%d-%m-%Y %H:%M:%S')
 
         # drop Null values
         df_params.drop(df_params.loc[df_params["VALUE"].isnull()]
                        .index, inplace=True, axis=0)
 
-        return trim_all_columns(df_params)
+        return Schema.apply(df_params)
 
     @staticmethod
-    def get_tasks(orders, arch_db):
+    def get_tasks(orders, arch_db, chunksize=None):
         """Extracts list of EMI tasks to be used in merging with special parameters"""
-        orders = create_sql_list("and", "mancode", orders)
-        sql_prd = f"""select mancode, manindex, taskid, batchid, elementid,
-                    pfccode, title from elan2406prd.e2s_pfc_task_man
+        def get_string(dbname):
+            return f"""select trim(mancode) as mancode, manindex, taskid, batchid, elementid,
+                        trim(pfccode) as pfccode, trim(title) as title
+                        from {dbname}.e2s_pfc_task_man
                         where status <> 6
-                        {orders}"""
+                        {key_filter("and", ["mancode"], "orders")}"""
 
-        df_prd = db.xfp_run_sql(sql_prd)
-
-        if arch_db:
-            sql_arch = f"""select mancode, manindex, taskid, batchid, elementid,
-            pfccode, title from arch2406prd.e2s_pfc_task_man
-                where status <> 6
-                {orders}"""
-            df_arch = db.xfp_run_sql(sql_arch)
-            df_tasks = pd.concat([df_prd, df_arch],
-                                 ignore_index=True,
-                                 sort=False) \
-                .drop_duplicates().reset_index(drop=True)
-        else:
-            df_tasks = df_prd.drop_duplicates().reset_index(drop=True)
-        return df_tasks
+        return Xfp.run_schemas(get_string, arch_db, chunksize,
+                               binds={"orders": list(orders)})